@@ -0,0 +1,285 @@
+import os
+import io
+import gzip
+import time
+import shutil
+import logging
+import tarfile
+import zipfile
+import tempfile
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from profiling import profile_file, profile_stage
+from memory_budget import get_memory_limit, under_pressure
+import csv_processing
+
+logger = logging.getLogger('converter')
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz', '.tar', '.csv.gz')
+# Rough peak memory of converting a member in memory, relative to its size
+# (raw bytes, decoded lines, parsed and translated rows, encoded output)
+MEMBER_MEMORY_FACTOR = 10
+# Fraction of the memory budget that members held in memory may use together
+IN_FLIGHT_SHARE = 0.5
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+def archive_output_path(archive_path):
+    """
+    items.zip -> items_translated.zip, drop.tar.gz -> drop_translated.tar.gz
+    """
+    lower = archive_path.lower()
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if lower.endswith(suffix):
+            return f"{archive_path[:-len(suffix)]}_translated{archive_path[-len(suffix):]}"
+    raise ValueError(f"Not a supported archive: {archive_path}")
+
+def is_csv_member(name):
+    return name.lower().endswith('.csv')
+
+def needs_spooling(size):
+    """
+    Members this large are spooled to a temporary file and converted on disk,
+    so they go through the chunked path and spill under a memory budget.
+    """
+    if size >= csv_processing.CHUNKED_THRESHOLD_BYTES:
+        return True
+    limit = get_memory_limit()
+    return bool(limit) and size * MEMBER_MEMORY_FACTOR > limit * IN_FLIGHT_SHARE
+
+def _spool(fileobj, prefix=b''):
+    with tempfile.NamedTemporaryFile(prefix='hermes_member_', suffix='.csv', delete=False) as f:
+        f.write(prefix)
+        shutil.copyfileobj(fileobj, f)
+        return f.name
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+def _convert_member(data, name, archive_path, index, total):
+    """
+    Returns the converted member bytes, or the original bytes when the member
+    could not be converted.
+    """
+    label = f"{archive_path}!{name}"
+    try:
+        converted = csv_processing.convert_and_translate_bytes(data, name, current_file=label, total_files=total, current_file_index=index)
+    except Exception as e:
+        logger.error(f"Error processing archive member {label}: {e}")
+        return data
+    return data if converted is None else converted
+
+def _convert_spooled_member(path, name, archive_path, index, total):
+    """
+    Converts a spooled member and returns the path holding the result: the
+    converted file, or the spooled original when it could not be converted.
+    The caller removes the returned file.
+    """
+    label = f"{archive_path}!{name}"
+    output_path = f"{path}.out"
+    try:
+        converted = csv_processing.convert_and_translate_spooled(path, output_path, name, current_file=label, total_files=total, current_file_index=index)
+    except Exception as e:
+        logger.error(f"Error processing archive member {label}: {e}")
+        converted = False
+    if converted:
+        _remove(path)
+        return output_path
+    _remove(output_path)
+    return path
+
+def _bounded_members(pool, fn, jobs, workers):
+    """
+    bounded_ordered_map for archive members. jobs yields (memory_cost, args).
+    Besides the count bound, members held in memory count toward the memory
+    budget: no new member is submitted while the process is under pressure or
+    while in-flight members would exceed IN_FLIGHT_SHARE of the budget.
+    Yields results in submission order.
+    """
+    limit = get_memory_limit()
+    pending = collections.deque()
+    in_flight = 0
+    for cost, args in jobs:
+        while pending and (len(pending) >= workers * 2 or (limit and (
+                in_flight + cost > limit * IN_FLIGHT_SHARE or under_pressure()))):
+            done_cost, future = pending.popleft()
+            in_flight -= done_cost
+            yield future.result()
+        pending.append((cost, pool.submit(fn, *args)))
+        in_flight += cost
+    while pending:
+        yield pending.popleft()[1].result()
+
+def _process_zip(archive_path, output_path, workers):
+    with zipfile.ZipFile(archive_path) as zf_in, zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf_out:
+        members = [info for info in zf_in.infolist() if not info.is_dir()]
+        total = sum(1 for info in members if is_csv_member(info.filename))
+
+        # CSV members are independent, so they are read and converted concurrently
+        # and written back in archive order. Returns (info, data, path) where
+        # data and path are None for members copied straight from the input.
+        def convert(info, index):
+            if index is None:
+                return info, None, None
+            if needs_spooling(info.file_size):
+                with zf_in.open(info) as src:
+                    path = _spool(src)
+                return info, None, _convert_spooled_member(path, info.filename, archive_path, index, total)
+            return info, _convert_member(zf_in.read(info), info.filename, archive_path, index, total), None
+
+        def jobs():
+            csv_index = 0
+            for info in members:
+                if not is_csv_member(info.filename):
+                    yield 0, (info, None)
+                    continue
+                csv_index += 1
+                cost = 0 if needs_spooling(info.file_size) else info.file_size * MEMBER_MEMORY_FACTOR
+                yield cost, (info, csv_index)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for info, data, path in _bounded_members(pool, convert, jobs(), workers):
+                out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                out_info.external_attr = info.external_attr
+                out_info.compress_type = zipfile.ZIP_DEFLATED
+                if data is not None:
+                    zf_out.writestr(out_info, data)
+                    continue
+                try:
+                    # Copied in chunks, so large members never sit in memory whole
+                    with (open(path, 'rb') if path else zf_in.open(info)) as src, zf_out.open(out_info, 'w', force_zip64=True) as dst:
+                        shutil.copyfileobj(src, dst)
+                finally:
+                    _remove(path)
+        return total
+
+def _process_tar(archive_path, output_path, workers):
+    write_mode = 'w:gz' if archive_path.lower().endswith(('.tar.gz', '.tgz')) else 'w'
+    # Stream mode reads the (compressed) archive front to back exactly once;
+    # members are read in order and only their conversion runs concurrently.
+    # Large members are spooled to temporary files instead of read into memory.
+    with tarfile.open(archive_path, 'r|*') as tf_in, tarfile.open(output_path, write_mode) as tf_out:
+        def jobs():
+            index = 0
+            for member in tf_in:
+                data = path = None
+                if member.isfile():
+                    src = tf_in.extractfile(member)
+                    if needs_spooling(member.size):
+                        path = _spool(src)
+                    else:
+                        data = src.read()
+                if member.isfile() and is_csv_member(member.name):
+                    index += 1
+                    yield (len(data) * MEMBER_MEMORY_FACTOR if data is not None else 0), (member, data, path, index)
+                else:
+                    yield 0, (member, data, path, None)
+
+        def convert(member, data, path, index):
+            if index is None:
+                return member, data, path
+            if path is not None:
+                return member, None, _convert_spooled_member(path, member.name, archive_path, index, None)
+            return member, _convert_member(data, member.name, archive_path, index, None), None
+
+        total = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for member, data, path in _bounded_members(pool, convert, jobs(), workers):
+                if data is None and path is None:
+                    tf_out.addfile(member)
+                    continue
+                if is_csv_member(member.name):
+                    total += 1
+                try:
+                    if path is not None:
+                        member.size = os.path.getsize(path)
+                        with open(path, 'rb') as src:
+                            tf_out.addfile(member, src)
+                    else:
+                        member.size = len(data)
+                        tf_out.addfile(member, io.BytesIO(data))
+                finally:
+                    _remove(path)
+        return total
+
+def _process_gzip(archive_path, output_path):
+    name = os.path.basename(archive_path)[:-3]
+    path = None
+    with gzip.open(archive_path, 'rb') as f:
+        # The uncompressed size is unknown up front, so read up to the spooling
+        # threshold and spool the rest only if there is more
+        data = f.read(csv_processing.CHUNKED_THRESHOLD_BYTES)
+        if len(data) >= csv_processing.CHUNKED_THRESHOLD_BYTES:
+            path = _spool(f, prefix=data)
+            data = None
+    try:
+        if path is not None:
+            path = _convert_spooled_member(path, name, archive_path, 1, 1)
+            with open(path, 'rb') as src, gzip.open(output_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            converted = _convert_member(data, name, archive_path, 1, 1)
+            with gzip.open(output_path, 'wb') as f:
+                f.write(converted)
+    finally:
+        _remove(path)
+    return 1
+
+def iter_csv_members(archive_path):
+    """
+    Yields (name, data) for each CSV member of an archive, one member in
+    memory at a time. Used by the planner, which only reads the members.
+    """
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and is_csv_member(info.filename):
+                    yield info.filename, zf.read(info)
+    elif lower.endswith('.csv.gz'):
+        with gzip.open(archive_path, 'rb') as f:
+            yield os.path.basename(archive_path)[:-3], f.read()
+    else:
+        with tarfile.open(archive_path, 'r|*') as tf:
+            for member in tf:
+                if member.isfile() and is_csv_member(member.name):
+                    yield member.name, tf.extractfile(member).read()
+
+def process_archive(archive_path, output_path=None, workers=None):
+    """
+    Converts and translates the CSV members of a .zip, .tar(.gz) or .csv.gz
+    archive without extracting it to disk, writing a new archive next to it
+    (see archive_output_path). Other members are copied unchanged.
+
+    Returns True on success.
+    """
+    output_path = output_path or archive_output_path(archive_path)
+    workers = workers or csv_processing.TRANSLATION_WORKERS
+    temp_output = f"{output_path}.part"
+    lower = archive_path.lower()
+    started = time.time()
+    logger.info(f"Processing archive {archive_path}")
+    profile_file(archive_path)
+    try:
+        # Zip and tar members convert on worker threads, which the profiler
+        # skips; the enclosing stage records the archive's wall time
+        with profile_stage('archive'):
+            if lower.endswith('.zip'):
+                count = _process_zip(archive_path, temp_output, workers)
+            elif lower.endswith('.csv.gz'):
+                count = _process_gzip(archive_path, temp_output)
+            else:
+                count = _process_tar(archive_path, temp_output, workers)
+        os.replace(temp_output, output_path)
+    except Exception as e:
+        logger.error(f"Error processing archive {archive_path}: {e}")
+        _remove(temp_output)
+        return False
+    logger.info(f"Wrote {count} converted CSV members of {archive_path} to {output_path} in {time.time() - started:.1f}s")
+    return True
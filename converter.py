@@ -1,14 +1,97 @@
 from logger import logger
+import csv_processing
 from csv_processing import process_all_csv_files
+from archive_io import is_archive, process_archive
 
+import os
 import sys
+import argparse
+
+def memory_size(value):
+    from memory_budget import parse_size
+    try:
+        size = parse_size(value)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(f"invalid size {value!r}, expected e.g. 512M, 2G or a number of MB")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {value!r}")
+    return size
+
+def translation_memory_path(value):
+    from translation_memory import detect_format
+    try:
+        detect_format(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def similarity(value):
+    try:
+        threshold = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid similarity {value!r}, expected a number between 0 and 1")
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError(f"similarity must be above 0 and at most 1, got {value!r}")
+    return threshold
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect, convert and translate CSV files.")
+    parser.add_argument('folder_path', nargs='?', help="Folder containing CSV files or archives, or a single .zip/.tar(.gz)/.csv.gz archive (prompted for if omitted)")
+    parser.add_argument('--plan', action='store_true', help="Scan the folder and estimate the run without translating")
+    parser.add_argument('--use-plan', action='store_true', help="Reuse detection results from the plan file instead of rescanning")
+    parser.add_argument('--plan-file', default='hermes_plan.json', help="Plan file written by --plan (default: hermes_plan.json)")
+    parser.add_argument('--latency', type=float, default=1.0, help="Average seconds per translator call assumed by --plan (default: 1.0)")
+    parser.add_argument('--max-memory', type=memory_size, default=None, help="Memory budget, e.g. 512M or 2G (plain numbers are MB); caches evict and buffers spill to disk to stay under it")
+    parser.add_argument('--import-tm', type=translation_memory_path, action='append', default=[], metavar='PATH', help="Load translation pairs from a .jsonl, .tsv or .tmx file (optionally .gz) before running; repeatable")
+    parser.add_argument('--export-tm', type=translation_memory_path, metavar='PATH', help="Write the translation store to a .jsonl, .tsv or .tmx file when the run ends")
+    parser.add_argument('--fuzzy-threshold', type=similarity, default=None, metavar='SIMILARITY', help="Reuse the translation of a near-duplicate string at least this similar (0-1, e.g. 0.9) instead of calling a translator; off by default")
+    parser.add_argument('--profile', action='store_true', help="Collect cProfile and tracemalloc stats per file and stage")
+    parser.add_argument('--profile-dir', default='hermes_profile', help="Output directory for --profile (default: hermes_profile)")
+    parser.add_argument('--serve', action='store_true', help="Run as a local HTTP translation/conversion service")
+    parser.add_argument('--host', default='127.0.0.1', help="Service bind address (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Service port (default: 8765)")
+    parser.add_argument('--rate', type=float, default=2.0, help="Service translator budget in calls per second (default: 2)")
+    parser.add_argument('--burst', type=int, default=50, help="Service translator burst budget (default: 50)")
+    parser.add_argument('--workers', type=int, default=4, help="Translation worker threads for the service and large files (default: 4)")
+    parser.add_argument('--chunk-workers', type=int, default=None, help="Worker processes for decoding and parsing large files (default: CPU count, max 8)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
+
+    if args.max_memory:
+        from memory_budget import set_memory_limit
+        set_memory_limit(args.max_memory)
+
+    if args.import_tm or args.export_tm:
+        import translation_memory
+    for tm_path in args.import_tm:
+        translation_memory.import_translation_memory(tm_path)
+
+    if args.fuzzy_threshold is not None:
+        from translation_utils import enable_fuzzy_matching
+        enable_fuzzy_matching(args.fuzzy_threshold)
+
+    if args.serve:
+        from service import serve
+        try:
+            serve(host=args.host, port=args.port, rate=args.rate, burst=args.burst, workers=args.workers)
+        except KeyboardInterrupt:
+            logger.info("\nService stopped by user. Exiting gracefully.")
+        finally:
+            if args.export_tm:
+                translation_memory.export_translation_memory(args.export_tm)
+        sys.exit(0)
+
     logger.info("Starting CSV encoding conversion and translation process...")
 
+    csv_processing.TRANSLATION_WORKERS = args.workers
+    if args.chunk_workers:
+        csv_processing.CHUNK_WORKERS = args.chunk_workers
+
     # Get folder path from command line argument or prompt user
-    if len(sys.argv) > 1:
-        folder_path = sys.argv[1]
+    if args.folder_path:
+        folder_path = args.folder_path
         logger.info(f"Using folder path from command line argument: {folder_path}")
     else:
         folder_path = input("Enter the folder path to detect and process CSV files (default is current directory): ").strip()
@@ -16,8 +99,34 @@ if __name__ == "__main__":
             folder_path = '.'
         logger.info(f"Using folder path from user input: {folder_path}")
 
+    if args.plan:
+        from planner import build_plan, save_plan, log_plan
+        plan = build_plan(root_dir=folder_path, workers=args.workers, avg_latency=args.latency)
+        save_plan(plan, args.plan_file)
+        log_plan(plan)
+        logger.info(f"Plan written to {args.plan_file}")
+        sys.exit(0)
+
+    plan = None
+    if args.use_plan:
+        from planner import load_plan
+        plan = load_plan(args.plan_file)
+
+    if args.profile:
+        from profiling import enable_profiling
+        enable_profiling(args.profile_dir)
+
     try:
-        process_all_csv_files(root_dir=folder_path)
+        if os.path.isfile(folder_path) and is_archive(folder_path):
+            process_archive(folder_path)
+        else:
+            process_all_csv_files(root_dir=folder_path, plan=plan)
     except KeyboardInterrupt:
         logger.info("\nProcess interrupted by user. Exiting gracefully.")
         sys.exit(0)
+    finally:
+        if args.profile:
+            from profiling import finish_profiling
+            finish_profiling()
+        if args.export_tm:
+            translation_memory.export_translation_memory(args.export_tm)
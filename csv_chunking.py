@@ -0,0 +1,73 @@
+import io
+import os
+import csv
+import logging
+import collections
+from encoding_utils import decode_mixed_encoding_lines
+
+logger = logging.getLogger('converter')
+
+CHUNK_SIZE_BYTES = 4 * 1024 * 1024
+
+def find_chunk_boundaries(file_path, chunk_size=CHUNK_SIZE_BYTES):
+    """
+    Splits a CSV file into byte ranges of roughly chunk_size that end on a
+    record boundary, i.e. a newline outside of any quoted field.
+
+    Quote parity is tracked on raw bytes; this is safe for UTF-8, GBK and
+    ISO-8859-9 because none of them use 0x22 or 0x0A inside a multi-byte
+    character.
+
+    Returns a list of (start, end, first_line) tuples covering the whole
+    file, first_line being the 1-based line number the range starts at.
+    """
+    ranges = []
+    start = 0
+    first_line = 1
+    offset = 0
+    line_no = 0
+    in_quotes = False
+    with open(file_path, 'rb') as f:
+        for raw_line in f:
+            offset += len(raw_line)
+            line_no += 1
+            if raw_line.count(b'"') % 2 == 1:
+                in_quotes = not in_quotes
+            if not in_quotes and offset - start >= chunk_size and raw_line.endswith(b'\n'):
+                ranges.append((start, offset, first_line))
+                start = offset
+                first_line = line_no + 1
+    if offset > start:
+        ranges.append((start, offset, first_line))
+    return ranges
+
+def parse_chunk(file_path, start, end, first_line=1, encoding_hint=None):
+    """
+    Reads bytes [start, end) of file_path, decodes them line by line the same
+    way as decode_mixed_encoding_file and parses them as CSV.
+
+    Runs in worker processes, so it must stay importable without the
+    translation backends.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    raw_lines = io.BytesIO(data).readlines()
+    decoded_lines = decode_mixed_encoding_lines(raw_lines, file_path, first_line=first_line, encoding_hint=encoding_hint)
+    return list(csv.reader(io.StringIO('\n'.join(decoded_lines))))
+
+def bounded_ordered_map(pool, fn, arg_tuples, max_pending):
+    """
+    Like pool.map, but keeps at most max_pending tasks outstanding so results
+    that finish out of order cannot pile up in memory. Yields in submission order.
+    """
+    pending = collections.deque()
+    for args in arg_tuples:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def default_workers():
+    return max(1, min(8, os.cpu_count() or 1))
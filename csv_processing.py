@@ -1,16 +1,29 @@
 import os
+import io
 import csv
 import sys
 import time
 import logging
 import json
-from translation_utils import contains_chinese, batch_translate_texts
-from encoding_utils import detect_encoding, file_contains_chinese
+import itertools
+import multiprocessing
+from translation_utils import contains_chinese, batch_translate_texts, log_translator_stats
+from encoding_utils import detect_encoding, detect_encoding_bytes, decode_mixed_encoding_lines, file_contains_chinese, encoding_display_name, detect_mojibake_columns, repair_mojibake_rows, MOJIBAKE_SAMPLE_ROWS
+from profiling import profile_file, profile_stage
+from csv_chunking import find_chunk_boundaries, parse_chunk, bounded_ordered_map, default_workers, CHUNK_SIZE_BYTES
+from memory_budget import SpillBuffer, window_rows
+from encoding_detection import detector, detect_file_encoding, log_detection_stats
 
 logger = logging.getLogger('converter')
 
 PROGRESS_FILE = 'translation_progress.json'
 
+ROWS_PER_WINDOW = 10
+# Files at least this large are split into chunks and processed concurrently
+CHUNKED_THRESHOLD_BYTES = 16 * 1024 * 1024
+CHUNK_WORKERS = default_workers()
+TRANSLATION_WORKERS = 4
+
 def load_progress():
     if os.path.exists(PROGRESS_FILE):
         try:
@@ -41,118 +54,332 @@ def print_progress_bar(current, total, bar_length=40):
     sys.stdout.write(f"{YELLOW}Processing file {current} of {total}:{RESET} [{arrow}{spaces}] {int(round(percent * 100))}%\n")
     sys.stdout.flush()
 
+def convert_row(translated_row, output_encoding):
+    import encoding_utils
+    # GBK-as-latin1 repair for utf-8 output happens per file in translate_window,
+    # only on columns detect_mojibake_columns flagged
+    if output_encoding.lower() == 'utf-8':
+        return list(translated_row)
+    # Convert only strings that are detected as utf-8 encoded to GBK if output_encoding is gbk
+    elif output_encoding.lower() == 'gbk':
+        converted_row = []
+        for cell in translated_row:
+            if isinstance(cell, str):
+                try:
+                    # Use safe encoding to GBK with replacement for errors
+                    encoded_bytes = encoding_utils.encode_utf8_to_gbk_safe(cell)
+                    decoded_cell = encoded_bytes.decode('gbk', errors='replace')
+                    converted_row.append(decoded_cell)
+                except Exception:
+                    # If any unexpected error, keep original
+                    converted_row.append(cell)
+            else:
+                converted_row.append(cell)
+        return converted_row
+    # If output encoding is neither utf-8 nor gbk, just return translated row as is
+    return translated_row
+
+def translate_window(batch_rows, output_encoding, mojibake_columns=None, **progress):
+    """
+    Translates one window of rows and converts the cells for output_encoding.
+    progress is passed through to batch_translate_texts for its log prefix.
+    Mojibake is repaired first, so the repaired Chinese text is what gets
+    translated.
+
+    Returns (converted_rows, repaired) where repaired counts the mojibake
+    cells fixed in mojibake_columns.
+    """
+    repaired = 0
+    if mojibake_columns:
+        batch_rows = [list(row) for row in batch_rows]
+        repaired = repair_mojibake_rows(batch_rows, mojibake_columns)
+    all_cells = [cell for row in batch_rows for cell in row]
+    translated_cells = batch_translate_texts(all_cells, **progress)
+
+    converted_rows = []
+    cell_idx = 0
+    for row in batch_rows:
+        row_len = len(row)
+        converted_rows.append(convert_row(translated_cells[cell_idx:cell_idx+row_len], output_encoding))
+        cell_idx += row_len
+    return converted_rows, repaired
+
+def find_mojibake_columns(rows, input_path, output_encoding):
+    """
+    Mojibake is only repaired when producing utf-8; the decision is made once
+    per file from a sample instead of attempting a re-decode on every cell.
+    """
+    if output_encoding.lower() != 'utf-8':
+        return set()
+    columns = detect_mojibake_columns(rows)
+    if columns:
+        logger.info(f"Detected GBK-as-latin1 mojibake in columns {sorted(columns)} of {input_path}")
+    return columns
+
+def open_output(output_path, output_encoding):
+    # Add errors='replace' for gbk encoding to avoid encoding errors
+    if output_encoding.lower() == 'gbk':
+        return open(output_path, 'w', encoding=output_encoding, errors='replace', newline='')
+    return open(output_path, 'w', encoding=output_encoding, newline='')
+
 def convert_and_translate_csv(input_path, output_path, input_encoding, output_encoding, do_translate=True, current_file=None, encoding_progress=None, encoding_name=None, total_files=None, current_file_index=None, start_row=0):
     import encoding_utils
     import io
+    if os.path.getsize(input_path) >= CHUNKED_THRESHOLD_BYTES:
+        return convert_and_translate_csv_chunked(input_path, output_path, input_encoding, output_encoding, do_translate=do_translate, current_file=current_file, encoding_name=encoding_name, total_files=total_files, current_file_index=current_file_index, start_row=start_row)
     logger.debug(f"Starting conversion from {input_encoding} to {output_encoding} for file {input_path} starting at row {start_row}")
     try:
         # Read file in binary mode and decode lines dynamically to handle mixed encodings
-        decoded_lines = encoding_utils.decode_mixed_encoding_file(input_path)
+        with profile_stage('decode'):
+            decoded_lines = encoding_utils.decode_mixed_encoding_file(input_path, input_encoding)
         # Use io.StringIO to create a file-like object from decoded lines for csv.reader
-        csv_content = io.StringIO('\n'.join(decoded_lines))
-        reader = csv.reader(csv_content)
-        rows = list(reader)
+        with profile_stage('parse'):
+            csv_content = io.StringIO('\n'.join(decoded_lines))
+            reader = csv.reader(csv_content)
+            rows = list(reader)
+        # The decoded text is not needed once parsed
+        del decoded_lines, csv_content, reader
 
-        fully_translated = False
-        translated_rows = rows[:start_row]  # Keep already translated rows if resuming
+        translated_rows = SpillBuffer()
+        translated_rows.extend(rows[:start_row])  # Keep already translated rows if resuming
 
         if do_translate:
+            mojibake_columns = find_mojibake_columns(rows, input_path, output_encoding)
+            repaired = 0
             idx = start_row
             total_rows = len(rows)
-            while idx < total_rows:
-                batch_rows = rows[idx:idx+10]  # process 10 rows at a time
-                all_cells = [cell for row in batch_rows for cell in row]
-                encoding_progress = int((idx + len(batch_rows)) / total_rows * 100)
-                translated_cells = batch_translate_texts(all_cells, current_file=current_file, encoding_progress=encoding_progress, encoding_name=encoding_name, total_files=total_files, current_file_index=current_file_index)
-
-                cell_idx = 0
-                for row in batch_rows:
-                    row_len = len(row)
-                    translated_row = translated_cells[cell_idx:cell_idx+row_len]
-                    # Convert only strings that are detected as GBK encoded to UTF-8 if output_encoding is utf-8
-                    if output_encoding.lower() == 'utf-8':
-                        converted_row = []
-                        for cell in translated_row:
-                            if isinstance(cell, str):
-                                try:
-                                    # Try decoding from gbk and encoding to utf-8
-                                    cell_bytes = cell.encode('latin1')
-                                    cell_utf8 = cell_bytes.decode('gbk')
-                                    converted_row.append(cell_utf8)
-                                except Exception:
-                                    # If decoding fails, keep original
-                                    converted_row.append(cell)
-                            else:
-                                converted_row.append(cell)
-                        translated_rows.append(converted_row)
-                    # Convert only strings that are detected as utf-8 encoded to GBK if output_encoding is gbk
-                    elif output_encoding.lower() == 'gbk':
-                        converted_row = []
-                        for cell in translated_row:
-                            if isinstance(cell, str):
-                                try:
-                                    # Use safe encoding to GBK with replacement for errors
-                                    encoded_bytes = encoding_utils.encode_utf8_to_gbk_safe(cell)
-                                    decoded_cell = encoded_bytes.decode('gbk', errors='replace')
-                                    converted_row.append(decoded_cell)
-                                except Exception:
-                                    # If any unexpected error, keep original
-                                    converted_row.append(cell)
-                            else:
-                                converted_row.append(cell)
-                        translated_rows.append(converted_row)
-                    else:
-                        # If output encoding is neither utf-8 nor gbk, just append translated row as is
-                        translated_rows.append(translated_row)
-                    cell_idx += row_len
-                idx += len(batch_rows)
-            fully_translated = True
+            with profile_stage('translate'):
+                while idx < total_rows:
+                    batch_rows = rows[idx:idx+window_rows(ROWS_PER_WINDOW)]
+                    encoding_progress = int((idx + len(batch_rows)) / total_rows * 100)
+                    converted_rows, window_repaired = translate_window(batch_rows, output_encoding, mojibake_columns, current_file=current_file, encoding_progress=encoding_progress, encoding_name=encoding_name, total_files=total_files, current_file_index=current_file_index)
+                    translated_rows.extend(converted_rows)
+                    # Release source rows once translated so spilled output is not also held here
+                    rows[idx:idx+len(batch_rows)] = [None] * len(batch_rows)
+                    repaired += window_repaired
+                    idx += len(batch_rows)
+            if repaired:
+                logger.info(f"Repaired {repaired} mojibake cells in {input_path}")
         else:
             translated_rows = rows
 
         # Write translated rows to output file with specified encoding
-        # Add errors='replace' for gbk encoding to avoid encoding errors
-        if output_encoding.lower() == 'gbk':
-            f_out = open(output_path, 'w', encoding=output_encoding, errors='replace', newline='')
-        else:
-            f_out = open(output_path, 'w', encoding=output_encoding, newline='')
-        with f_out:
+        with profile_stage('write'), open_output(output_path, output_encoding) as f_out:
             writer = csv.writer(f_out)
             writer.writerows(translated_rows)
+        if isinstance(translated_rows, SpillBuffer):
+            if translated_rows.spilled:
+                logger.info(f"Spilled {translated_rows.spilled} translated rows of {input_path} to disk")
+            translated_rows.close()
 
         return True
     except Exception as e:
         logger.error(f"Error processing file {input_path}: {e}")
         return False
 
-def process_all_csv_files(root_dir='.'):
+def convert_and_translate_csv_chunked(input_path, output_path, input_encoding, output_encoding, do_translate=True, current_file=None, encoding_name=None, total_files=None, current_file_index=None, start_row=0):
+    """
+    Variant of convert_and_translate_csv for large files. The file is split into
+    chunks on record boundaries that are decoded and parsed in worker processes,
+    row windows are translated concurrently in threads, and the results are
+    written back in order to a temporary file that atomically replaces output_path.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    logger.debug(f"Starting chunked conversion from {input_encoding} to {output_encoding} for file {input_path} starting at row {start_row}")
+    temp_output = f"{output_path}.part"
+    try:
+        ranges = find_chunk_boundaries(input_path, CHUNK_SIZE_BYTES)
+        logger.info(f"Parsing {input_path} as {len(ranges)} chunks with {CHUNK_WORKERS} worker processes")
+        rows = SpillBuffer()
+        mojibake_sample = []
+        sample_per_chunk = max(1, MOJIBAKE_SAMPLE_ROWS // len(ranges))
+        # Decoding and parsing happen in the worker processes, so they profile as one stage.
+        # Workers are spawned: a forked child would inherit the translation caches and any
+        # lock another thread (archive members, the service) holds at that moment.
+        with profile_stage('decode_parse_chunks'), ProcessPoolExecutor(max_workers=max(1, min(CHUNK_WORKERS, len(ranges))), mp_context=multiprocessing.get_context('spawn')) as pool:
+            # Chunks come back in order with a bounded number outstanding,
+            # and rows move to disk under memory pressure
+            for chunk_rows in bounded_ordered_map(pool, parse_chunk, ((input_path, start, end, first_line, input_encoding) for start, end, first_line in ranges), CHUNK_WORKERS * 2):
+                step = max(1, len(chunk_rows) // sample_per_chunk)
+                mojibake_sample.extend(chunk_rows[::step][:sample_per_chunk])
+                rows.extend(chunk_rows)
+        total_rows = len(rows)
+        mojibake_columns = find_mojibake_columns(mojibake_sample, input_path, output_encoding) if do_translate else set()
+        del mojibake_sample
+        repaired = 0
+
+        def run_window(idx, batch_rows):
+            encoding_progress = int((idx + len(batch_rows)) / total_rows * 100)
+            return translate_window(batch_rows, output_encoding, mojibake_columns, current_file=current_file, encoding_progress=encoding_progress, encoding_name=encoding_name, total_files=total_files, current_file_index=current_file_index)
+
+        def iter_windows(row_iter):
+            idx = start_row
+            while True:
+                batch_rows = list(itertools.islice(row_iter, window_rows(ROWS_PER_WINDOW)))
+                if not batch_rows:
+                    return
+                yield idx, batch_rows
+                idx += len(batch_rows)
+
+        with profile_stage('translate' if do_translate else 'write'), open_output(temp_output, output_encoding) as f_out:
+            writer = csv.writer(f_out)
+            if do_translate:
+                row_iter = iter(rows)
+                writer.writerows(itertools.islice(row_iter, start_row))  # Keep already translated rows if resuming
+                with ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS) as pool:
+                    # Windows are written in submission order; the bound keeps finished
+                    # out-of-order windows from piling up behind a slow one
+                    for converted_rows, window_repaired in bounded_ordered_map(pool, run_window, iter_windows(row_iter), TRANSLATION_WORKERS * 2):
+                        writer.writerows(converted_rows)
+                        repaired += window_repaired
+            else:
+                writer.writerows(rows)
+        if rows.spilled:
+            logger.info(f"Spilled {rows.spilled} parsed rows of {input_path} to disk")
+        rows.close()
+        os.replace(temp_output, output_path)
+        if repaired:
+            logger.info(f"Repaired {repaired} mojibake cells in {input_path}")
+        return True
+    except Exception as e:
+        logger.error(f"Error processing file {input_path}: {e}")
+        try:
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+        except OSError:
+            pass
+        return False
+
+def output_encoding_for(encoding_name):
+    """
+    Final encoding the pipeline writes for a detected encoding: GBK and UTF-8
+    input end up as GBK, ISO-8859-9 stays ISO-8859-9. None if unsupported.
+    """
+    if encoding_name in ('GBK', 'UTF-8'):
+        return 'gbk'
+    elif encoding_name == 'ISO-8859-9':
+        return 'iso-8859-9'
+    return None
+
+def convert_and_translate_bytes(data, name, current_file=None, total_files=None, current_file_index=None):
+    """
+    In-memory equivalent of the per-file steps in process_all_csv_files, for CSV
+    data that does not live on disk (archive members). The intermediate UTF-8
+    files of the on-disk flow are skipped: rows are decoded, translated as UTF-8
+    and converted once to the final encoding.
+
+    Returns the converted CSV as bytes, or None if the encoding is unsupported.
+    """
+    current_file = current_file or name
+    with profile_stage('detect_encoding'):
+        encoding = detect_encoding_bytes(data)
+    encoding_name = encoding_display_name(encoding)
+    output_encoding = output_encoding_for(encoding_name)
+    if output_encoding is None:
+        logger.warning(f"Unsupported encoding {encoding_name} for {name}, copying it unchanged.")
+        return None
+
+    with profile_stage('decode'):
+        decoded_lines = decode_mixed_encoding_lines(io.BytesIO(data).readlines(), name, encoding_hint=encoding)
+    with profile_stage('parse'):
+        rows = list(csv.reader(io.StringIO('\n'.join(decoded_lines))))
+    del decoded_lines
+
+    if any(contains_chinese(cell) for row in rows for cell in row):
+        logger.debug(f"{name} contains Chinese, translating to English")
+        mojibake_columns = find_mojibake_columns(rows, name, 'utf-8')
+        translated_rows = []
+        total_rows = len(rows)
+        with profile_stage('translate'):
+            idx = 0
+            while idx < total_rows:
+                batch_rows = rows[idx:idx+window_rows(ROWS_PER_WINDOW)]
+                encoding_progress = int((idx + len(batch_rows)) / total_rows * 100)
+                converted_rows, _ = translate_window(batch_rows, 'utf-8', mojibake_columns, current_file=current_file, encoding_progress=encoding_progress, encoding_name='UTF-8', total_files=total_files, current_file_index=current_file_index)
+                translated_rows.extend(converted_rows)
+                idx += len(batch_rows)
+        rows = translated_rows
+
+    with profile_stage('write'):
+        buffer = io.StringIO(newline='')
+        writer = csv.writer(buffer)
+        writer.writerows(convert_row(row, output_encoding) for row in rows)
+        return buffer.getvalue().encode(output_encoding, errors='replace')
+
+def convert_and_translate_spooled(input_path, output_path, name, current_file=None, total_files=None, current_file_index=None):
+    """
+    On-disk counterpart of convert_and_translate_bytes for archive members too
+    large to hold in memory. Both steps go through convert_and_translate_csv,
+    so large members use the chunked path and spill under a memory budget.
+
+    Returns True on success, False on failure and None if the encoding is
+    unsupported.
+    """
+    current_file = current_file or name
+    with profile_stage('detect_encoding'):
+        encoding = detect_encoding(input_path)
+    encoding_name = encoding_display_name(encoding)
+    output_encoding = output_encoding_for(encoding_name)
+    if output_encoding is None:
+        logger.warning(f"Unsupported encoding {encoding_name} for {name}, copying it unchanged.")
+        return None
+    input_encoding = {'GBK': 'gbk', 'UTF-8': 'utf-8'}.get(encoding_name, output_encoding)
+
+    temp_translated_file = f"{output_path}.utf8"
+    try:
+        if not convert_and_translate_csv(input_path, temp_translated_file, input_encoding, 'utf-8', do_translate=True, current_file=current_file, encoding_progress=0, encoding_name='UTF-8', total_files=total_files, current_file_index=current_file_index):
+            return False
+        return convert_and_translate_csv(temp_translated_file, output_path, 'utf-8', output_encoding, do_translate=False, current_file=current_file)
+    finally:
+        try:
+            if os.path.exists(temp_translated_file):
+                os.remove(temp_translated_file)
+        except OSError:
+            pass
+
+def scan_for_chinese(file_path, encoding):
+    with profile_stage('chinese_scan'):
+        return file_contains_chinese(file_path, encoding)
+
+def find_csv_files(root_dir='.'):
     csv_files = []
     for dirpath, _, filenames in os.walk(root_dir):
         for filename in filenames:
             if filename.lower().endswith('.csv'):
                 csv_files.append(os.path.join(dirpath, filename))
+    return csv_files
+
+def find_archives(root_dir='.'):
+    from archive_io import is_archive
+    archives = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            # Skip outputs of a previous run
+            if is_archive(path) and '_translated' not in filename:
+                archives.append(path)
+    return archives
+
+def process_all_csv_files(root_dir='.', plan=None):
+    csv_files = find_csv_files(root_dir)
 
     total_files = len(csv_files)
     print(f"Total CSV files to process: {total_files}")
 
     progress = load_progress()
+    if plan:
+        from planner import planned_file_entry
 
     for idx, input_file in enumerate(csv_files, start=1):
         print(f"Processing file {idx} of {total_files}: {input_file}")
+        profile_file(input_file)
         base, ext = os.path.splitext(os.path.basename(input_file))
-        encoding = detect_encoding(input_file)
+        # Reuse detection and Chinese scan results from a --plan run when the file is unchanged
+        planned = planned_file_entry(plan, input_file) if plan else None
+        with profile_stage('detect_encoding'):
+            encoding = planned['encoding'] if planned else detect_file_encoding(input_file)
         encoding_progress = int(idx / total_files * 100)
-        encoding_name = None
-        if encoding:
-            enc_lower = encoding.lower()
-            if enc_lower == 'utf-8' or enc_lower == 'ascii':
-                encoding_name = 'UTF-8'
-            elif enc_lower == 'gbk' or enc_lower == 'gb2312':
-                encoding_name = 'GBK'
-            elif enc_lower == 'iso-8859-9':
-                encoding_name = 'ISO-8859-9'
-            else:
-                encoding_name = encoding.upper()
+        encoding_name = encoding_display_name(encoding)
 
         start_row = progress.get(input_file, 0)
 
@@ -165,7 +392,7 @@ def process_all_csv_files(root_dir='.'):
                 logger.error(f"Error converting {input_file} from GBK to UTF-8")
                 continue
             # Now check if UTF-8 file contains Chinese
-            if file_contains_chinese(temp_utf8_file, 'utf-8'):
+            if planned['contains_chinese'] if planned else scan_for_chinese(temp_utf8_file, 'utf-8'):
                 logger.debug(f"UTF-8 file {temp_utf8_file} contains Chinese, translating to English")
                 temp_translated_file = os.path.join(os.path.dirname(input_file), f"{base}_utf8_translated{ext}")
                 success = convert_and_translate_csv(temp_utf8_file, temp_translated_file, 'utf-8', 'utf-8', do_translate=True, current_file=input_file, encoding_progress=encoding_progress, encoding_name='UTF-8', total_files=total_files, current_file_index=idx, start_row=start_row)
@@ -199,7 +426,7 @@ def process_all_csv_files(root_dir='.'):
 
         # Step 2: If file is UTF-8, check for Chinese and translate, then convert back to GBK
         elif encoding_name == 'UTF-8':
-            if file_contains_chinese(input_file, 'utf-8'):
+            if planned['contains_chinese'] if planned else scan_for_chinese(input_file, 'utf-8'):
                 logger.debug(f"UTF-8 file {input_file} contains Chinese, translating to English")
                 temp_translated_file = os.path.join(os.path.dirname(input_file), f"{base}_utf8_translated{ext}")
                 success = convert_and_translate_csv(input_file, temp_translated_file, 'utf-8', 'utf-8', do_translate=True, current_file=input_file, encoding_progress=encoding_progress, encoding_name='UTF-8', total_files=total_files, current_file_index=idx, start_row=start_row)
@@ -229,7 +456,7 @@ def process_all_csv_files(root_dir='.'):
 
         elif encoding_name == 'ISO-8859-9':
             # Treat ISO-8859-9 similar to UTF-8 for processing
-            if file_contains_chinese(input_file, 'iso-8859-9'):
+            if planned['contains_chinese'] if planned else scan_for_chinese(input_file, 'iso-8859-9'):
                 logger.debug(f"ISO-8859-9 file {input_file} contains Chinese, translating to English")
                 temp_translated_file = os.path.join(os.path.dirname(input_file), f"{base}_iso88599_translated{ext}")
                 success = convert_and_translate_csv(input_file, temp_translated_file, 'iso-8859-9', 'utf-8', do_translate=True, current_file=input_file, encoding_progress=encoding_progress, encoding_name='ISO-8859-9', total_files=total_files, current_file_index=idx, start_row=start_row)
@@ -268,8 +495,18 @@ def process_all_csv_files(root_dir='.'):
                 os.remove(input_file)
                 logger.debug(f"Renaming {final_output_file} to {input_file}")
                 os.rename(final_output_file, input_file)
+                detector.record(input_file, output_encoding_for(encoding_name))
                 logger.debug(f"Successfully replaced original file {input_file} with {final_output_file}")
             except Exception as e:
                 logger.error(f"Error replacing file {input_file}: {e}")
 
+    archives = find_archives(root_dir)
+    if archives:
+        from archive_io import process_archive
+        for archive_path in archives:
+            process_archive(archive_path)
+
     print("\nProcessing completed.")
+    log_translator_stats()
+    log_detection_stats()
+    detector.save()
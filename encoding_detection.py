@@ -0,0 +1,234 @@
+import os
+import json
+import codecs
+import logging
+import threading
+import collections
+from encoding_utils import detect_encoding_result, encoding_display_name, strict_codec
+
+logger = logging.getLogger('converter')
+
+ENCODING_CACHE_FILE = 'encoding_cache.json'
+ENCODING_CACHE_VERSION = 1
+DETECT_BYTES = 10000
+# A directory prior needs this many non-ASCII verdicts, nearly all agreeing
+PRIOR_MIN_FILES = 2
+PRIOR_MIN_SHARE = 0.9
+LOW_CONFIDENCE = 0.5
+# Bytes of non-ASCII text chardet checks to confirm a GBK prior
+PRIOR_CHECK_BYTES = 2048
+
+class EncodingDetector:
+    """
+    File encoding detection with a verdict cache and per-directory priors.
+
+    Verdicts are cached by path, size and mtime and persisted between runs.
+    Files in a directory almost always share one encoding, so once enough
+    siblings agree, a new file is confirmed with a strict decode of the bytes
+    chardet would look at. A strict GBK decode also accepts other double-byte
+    encodings such as EUC-KR, so a GBK prior is additionally confirmed by
+    chardet on a short slice. Full detection only runs when there is no usable
+    prior, when the prior is a single-byte encoding that a strict decode
+    cannot check, or when the check fails.
+    """
+
+    def __init__(self, cache_file=ENCODING_CACHE_FILE):
+        self.cache_file = cache_file
+        self.verdicts = {}
+        self.priors = {}
+        self.counts = collections.Counter()
+        self.confidences = []
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def load(self):
+        with self._lock:
+            self._loaded = True
+            if not self.cache_file or not os.path.exists(self.cache_file):
+                return
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load encoding cache {self.cache_file}: {e}")
+                return
+            if data.get('version') != ENCODING_CACHE_VERSION:
+                logger.warning(f"Encoding cache {self.cache_file} has unsupported version {data.get('version')}, ignoring it.")
+                return
+            self.verdicts = data.get('verdicts', {})
+            for file_path, verdict in self.verdicts.items():
+                self._learn(file_path, verdict['encoding'])
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self._lock:
+            data = {'version': ENCODING_CACHE_VERSION, 'verdicts': self.verdicts}
+            try:
+                temp_path = f"{self.cache_file}.part"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(temp_path, self.cache_file)
+            except Exception as e:
+                logger.error(f"Failed to save encoding cache {self.cache_file}: {e}")
+
+    def _learn(self, file_path, encoding):
+        # Pure ASCII fits any prior, so it does not vote
+        if encoding and encoding.lower() != 'ascii':
+            # Keyed by path, so a file detected again after it changed is counted once
+            self.priors.setdefault(os.path.dirname(file_path), {})[file_path] = encoding
+
+    def prior(self, directory):
+        """
+        Returns the encoding nearly all verdicts in directory agree on, or None.
+        """
+        counts = collections.Counter(self.priors.get(directory, {}).values())
+        if not counts:
+            return None
+        total = sum(counts.values())
+        by_name = collections.Counter()
+        for encoding, count in counts.items():
+            by_name[encoding_display_name(encoding)] += count
+        name, count = by_name.most_common(1)[0]
+        if total < PRIOR_MIN_FILES or count / total < PRIOR_MIN_SHARE:
+            return None
+        # The most common raw chardet name within the winning group, e.g. GB2312
+        return max((encoding for encoding in counts if encoding_display_name(encoding) == name), key=counts.get)
+
+    @staticmethod
+    def _confirm(data, prior):
+        """
+        Strict-decode check of the sample against the directory prior.
+        Returns the encoding chardet would report, or None if the check fails.
+        """
+        codec = strict_codec(prior)
+        if codec is None:
+            return None
+        # chardet reports pure ASCII as ascii whatever the directory holds
+        if data.isascii():
+            return 'ascii'
+        if codec == 'gbk':
+            # UTF-8 bytes can pass a GBK decode, GBK bytes are almost never valid UTF-8
+            try:
+                data.decode('utf-8')
+                return None
+            except UnicodeDecodeError:
+                pass
+        try:
+            # A multibyte character may be cut at the end of the sample
+            codecs.getincrementaldecoder(codec)().decode(data, final=False)
+        except UnicodeDecodeError:
+            return None
+        if codec == 'utf-8':
+            return 'utf-8'
+        # Slice from the start of the line holding the first non-ASCII byte
+        first = next(i for i, byte in enumerate(data) if byte >= 0x80)
+        start = data.rfind(b'\n', 0, first) + 1
+        encoding, _ = detect_encoding_result(data[start:start + PRIOR_CHECK_BYTES], PRIOR_CHECK_BYTES)
+        return prior if encoding_display_name(encoding) == encoding_display_name(prior) else None
+
+    def detect(self, file_path):
+        """
+        Returns the encoding of file_path as chardet would name it, or None if
+        it cannot be read.
+        """
+        if not self._loaded:
+            self.load()
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Error detecting encoding for file {file_path}: {e}")
+            return None
+        with self._lock:
+            verdict = self.verdicts.get(file_path)
+            if verdict and verdict['size'] == stat.st_size and verdict['mtime_ns'] == stat.st_mtime_ns:
+                self.counts['cached'] += 1
+                return verdict['encoding']
+            prior = self.prior(os.path.dirname(file_path))
+
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read(DETECT_BYTES)
+        except OSError as e:
+            logger.error(f"Error detecting encoding for file {file_path}: {e}")
+            return None
+
+        # A single-byte prior cannot be checked, so going to chardet is not a rejection
+        checked = prior is not None and strict_codec(prior) is not None
+        encoding = self._confirm(data, prior) if checked else None
+        if encoding is not None:
+            confidence, source = None, 'prior'
+        else:
+            if checked:
+                with self._lock:
+                    self.counts['prior_rejected'] += 1
+                logger.debug(f"{file_path} does not match the {prior} prior of its directory, running full detection")
+            encoding, confidence = detect_encoding_result(data, DETECT_BYTES)
+            source = 'chardet'
+
+        with self._lock:
+            self.counts[source] += 1
+            self._learn(file_path, encoding)
+            if source == 'chardet':
+                self.confidences.append(confidence)
+                if confidence < LOW_CONFIDENCE:
+                    logger.warning(f"Low confidence ({confidence:.2f}) detecting {encoding} for {file_path}")
+            self.verdicts[file_path] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'encoding': encoding,
+                'confidence': confidence,
+                'source': source,
+            }
+        return encoding
+
+    def record(self, file_path, encoding):
+        """
+        Stores the verdict for a file this run wrote in a known encoding, so
+        the next run does not detect it again.
+        """
+        if not self._loaded:
+            self.load()
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Error recording encoding for file {file_path}: {e}")
+            return
+        with self._lock:
+            self._learn(file_path, encoding)
+            self.verdicts[file_path] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'encoding': encoding,
+                'confidence': None,
+                'source': 'written',
+            }
+
+    def summary(self):
+        with self._lock:
+            confidences = list(self.confidences)
+            encodings = collections.Counter(encoding_display_name(verdict['encoding']) or 'UNKNOWN' for verdict in self.verdicts.values())
+            return {
+                'cached': self.counts['cached'],
+                'prior': self.counts['prior'],
+                'chardet': self.counts['chardet'],
+                'prior_rejected': self.counts['prior_rejected'],
+                'directories_with_prior': sum(1 for directory in self.priors if self.prior(directory) is not None),
+                'min_confidence': min(confidences) if confidences else None,
+                'mean_confidence': sum(confidences) / len(confidences) if confidences else None,
+                'low_confidence': sum(1 for confidence in confidences if confidence < LOW_CONFIDENCE),
+                'encodings': dict(encodings),
+            }
+
+detector = EncodingDetector()
+
+def detect_file_encoding(file_path):
+    return detector.detect(file_path)
+
+def log_detection_stats():
+    summary = detector.summary()
+    logger.info(f"Encoding detection: {summary['cached']} cached, {summary['prior']} confirmed by directory prior, "
+                f"{summary['chardet']} full detections ({summary['prior_rejected']} after a prior did not match)")
+    if summary['mean_confidence'] is not None:
+        logger.info(f"Detection confidence: mean {summary['mean_confidence']:.2f}, min {summary['min_confidence']:.2f}, "
+                    f"{summary['low_confidence']} below {LOW_CONFIDENCE}")
@@ -7,12 +7,45 @@ def detect_encoding(file_path, num_bytes=10000):
     try:
         with open(file_path, 'rb') as f:
             rawdata = f.read(num_bytes)
-        result = chardet.detect(rawdata)
-        return result['encoding']
+        return detect_encoding_bytes(rawdata)
     except Exception as e:
         logger.error(f"Error detecting encoding for file {file_path}: {e}")
         return None
 
+def detect_encoding_bytes(data, num_bytes=10000):
+    return detect_encoding_result(data, num_bytes)[0]
+
+def detect_encoding_result(data, num_bytes=10000):
+    """
+    Returns chardet's (encoding, confidence) for the first num_bytes of data.
+    """
+    result = chardet.detect(data[:num_bytes])
+    return result['encoding'], result.get('confidence', 0.0)
+
+def encoding_display_name(encoding):
+    """
+    Maps a chardet encoding name onto the names the pipeline branches on
+    (UTF-8, GBK, ISO-8859-9). Returns None if encoding is None.
+    """
+    if not encoding:
+        return None
+    enc_lower = encoding.lower()
+    if enc_lower == 'utf-8' or enc_lower == 'ascii':
+        return 'UTF-8'
+    elif enc_lower == 'gbk' or enc_lower == 'gb2312':
+        return 'GBK'
+    elif enc_lower == 'iso-8859-9':
+        return 'ISO-8859-9'
+    return encoding.upper()
+
+def strict_codec(encoding):
+    """
+    Python codec for encodings whose strict decode is a meaningful check
+    (invalid input raises), or None for single-byte encodings that accept
+    any byte sequence.
+    """
+    return {'UTF-8': 'utf-8', 'GBK': 'gbk'}.get(encoding_display_name(encoding))
+
 def contains_chinese(text):
     for ch in text:
         if '\u4e00' <= ch <= '\u9fff':
@@ -23,7 +56,7 @@ def file_contains_chinese(file_path, encoding):
     try:
         logger.debug(f"Checking if file {file_path} contains Chinese characters with encoding {encoding}...")
         # Use decode_mixed_encoding_file to read file robustly
-        decoded_lines = decode_mixed_encoding_file(file_path)
+        decoded_lines = decode_mixed_encoding_file(file_path, encoding)
         content = '\n'.join(decoded_lines)
         has_chinese = contains_chinese(content)
         logger.debug(f"file_contains_chinese for {file_path} with mixed decoding: {has_chinese}")
@@ -39,41 +72,144 @@ def is_english(text):
     except UnicodeEncodeError:
         return False
 
-def decode_mixed_encoding_file(file_path):
+def _decode_with_hint(raw_line, codec):
+    """
+    Strict decode of one line with the file's known encoding. Valid UTF-8 is
+    tried first, since GBK bytes are almost never valid UTF-8 but UTF-8 bytes
+    can pass as GBK. Returns None if neither decode succeeds.
+    """
+    if raw_line.isascii():
+        return raw_line.decode('ascii')
+    try:
+        return raw_line.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    if codec != 'utf-8':
+        try:
+            return raw_line.decode(codec)
+        except UnicodeDecodeError:
+            pass
+    return None
+
+def decode_mixed_encoding_lines(raw_lines, file_path=None, first_line=1, encoding_hint=None):
+    """
+    Decodes raw byte lines by detecting encoding per line dynamically,
+    with errors='replace' to avoid decode errors. With an encoding_hint for
+    the file, lines that decode strictly as that encoding skip detection.
+
+    Returns the decoded lines without line terminators.
+    """
+    codec = strict_codec(encoding_hint) if encoding_hint else None
+    decoded_lines = []
+    for i, raw_line in enumerate(raw_lines, start=first_line):
+        if codec is not None:
+            decoded_line = _decode_with_hint(raw_line, codec)
+            if decoded_line is not None:
+                decoded_lines.append(decoded_line.rstrip('\r\n'))
+                continue
+        try:
+            detection = chardet.detect(raw_line)
+            encoding = detection.get('encoding')
+            confidence = detection.get('confidence', 0)
+            if encoding is None or confidence < 0.5:
+                encoding = 'utf-8'  # default fallback
+            decoded_line = raw_line.decode(encoding, errors='replace').rstrip('\r\n')
+            logger.debug(f"Line {i} decoded as {encoding} with confidence {confidence:.2f}")
+            decoded_lines.append(decoded_line)
+        except Exception as e:
+            logger.error(f"Error decoding line {i} in file {file_path}: {e}")
+            decoded_lines.append('')  # Append empty string on error to keep line count
+    return decoded_lines
+
+def decode_mixed_encoding_file(file_path, encoding_hint=None):
     """
     Reads a file with mixed encodings by detecting encoding per line dynamically.
     Decodes each line using detected encoding with errors='replace' to avoid decode errors.
+    encoding_hint is passed on to decode_mixed_encoding_lines.
 
     Returns the decoded content as a list of strings (lines).
     """
-    import logging
-    import chardet
-    logger = logging.getLogger('converter')
-    decoded_lines = []
     try:
         with open(file_path, 'rb') as f:
             raw_lines = f.readlines()
         total_lines = len(raw_lines)
         logger.info(f"Total lines in file {file_path}: {total_lines}")
-
-        for i, raw_line in enumerate(raw_lines, start=1):
-            try:
-                detection = chardet.detect(raw_line)
-                encoding = detection.get('encoding')
-                confidence = detection.get('confidence', 0)
-                if encoding is None or confidence < 0.5:
-                    encoding = 'utf-8'  # default fallback
-                decoded_line = raw_line.decode(encoding, errors='replace').rstrip('\r\n')
-                logger.debug(f"Line {i} decoded as {encoding} with confidence {confidence:.2f}")
-                decoded_lines.append(decoded_line)
-            except Exception as e:
-                logger.error(f"Error decoding line {i} in file {file_path}: {e}")
-                decoded_lines.append('')  # Append empty string on error to keep line count
-        return decoded_lines
+        return decode_mixed_encoding_lines(raw_lines, file_path, encoding_hint=encoding_hint)
     except Exception as e:
         logger.error(f"Failed to read file {file_path} in binary mode: {e}")
         return []
 
+MOJIBAKE_SAMPLE_ROWS = 200
+MOJIBAKE_MIN_RATIO = 0.8
+
+def repair_mojibake_cell(cell):
+    """
+    Returns the GBK reading of a cell that holds GBK bytes decoded as latin1,
+    or None if the cell does not look like that kind of mojibake.
+    """
+    # ASCII is identical in both readings and anything above U+00FF cannot be latin1
+    if cell.isascii() or max(cell) > '\xff':
+        return None
+    try:
+        repaired = cell.encode('latin1').decode('gbk')
+    except UnicodeError:
+        return None
+    return repaired if contains_chinese(repaired) else None
+
+def looks_like_gbk_mojibake(cell):
+    """
+    Stricter test used for sampling: besides repairing to Chinese, every
+    high byte must pair with another high byte as in GB2312 text. Latin1
+    words like 'naïve' can decode as GBK but fail this check.
+    """
+    if repair_mojibake_cell(cell) is None:
+        return False
+    raw = cell.encode('latin1')
+    i = 0
+    while i < len(raw):
+        if raw[i] < 0x80:
+            i += 1
+        elif i + 1 < len(raw) and raw[i + 1] >= 0x80:
+            i += 2
+        else:
+            return False
+    return True
+
+def detect_mojibake_columns(rows, sample_rows=MOJIBAKE_SAMPLE_ROWS, min_ratio=MOJIBAKE_MIN_RATIO):
+    """
+    Decides from an evenly spaced sample of rows which columns carry
+    GBK-as-latin1 mojibake: a column qualifies when at least min_ratio of its
+    sampled latin1-only, non-ASCII cells look like GBK bytes.
+
+    Returns a set of column indices.
+    """
+    non_ascii = {}
+    repairable = {}
+    step = max(1, len(rows) // sample_rows)
+    for row in rows[::step][:sample_rows]:
+        for col, cell in enumerate(row):
+            # Only non-ASCII cells that fit in latin1 could be mojibake at all
+            if isinstance(cell, str) and not cell.isascii() and max(cell) <= '\xff':
+                non_ascii[col] = non_ascii.get(col, 0) + 1
+                if looks_like_gbk_mojibake(cell):
+                    repairable[col] = repairable.get(col, 0) + 1
+    return {col for col, count in non_ascii.items() if repairable.get(col, 0) / count >= min_ratio}
+
+def repair_mojibake_rows(rows, columns):
+    """
+    Repairs mojibake cells in the given columns in place.
+    Returns the number of cells changed.
+    """
+    changed = 0
+    for row in rows:
+        for col in columns:
+            if col < len(row) and isinstance(row[col], str):
+                repaired = repair_mojibake_cell(row[col])
+                if repaired is not None:
+                    row[col] = repaired
+                    changed += 1
+    return changed
+
 def encode_utf8_to_gbk_safe(text):
     """
     Safely encodes a UTF-8 decoded string to GBK encoding.
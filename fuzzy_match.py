@@ -0,0 +1,181 @@
+import gc
+import re
+import time
+import logging
+import threading
+import unicodedata
+from array import array
+
+logger = logging.getLogger('converter')
+
+# Shortest normalized string that is matched fuzzily; shorter ones only match after normalization
+MIN_FUZZY_LENGTH = 4
+# Upper bound on candidates verified per lookup, so very common bigrams cannot stall a lookup
+MAX_CANDIDATES = 2000
+
+# CJK punctuation NFKC leaves alone
+PUNCTUATION_MAP = str.maketrans({
+    '。': '.', '、': ',', '“': '"', '”': '"', '‘': "'", '’': "'",
+    '【': '[', '】': ']', '《': '<', '》': '>', '〈': '<', '〉': '>',
+    '「': '"', '」': '"', '『': '"', '』': '"', '…': '...', '—': '-',
+})
+WHITESPACE_RE = re.compile(r'\s+')
+DIGITS_RE = re.compile(r'\d+')
+
+def normalize_text(text):
+    """
+    Folds full-width forms, CJK punctuation and whitespace runs so strings that
+    differ only in those compare equal.
+    """
+    text = unicodedata.normalize('NFKC', text).translate(PUNCTUATION_MAP)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def bigrams(text):
+    return {text[i:i+2] for i in range(len(text) - 1)}
+
+def bounded_edit_distance(a, b, max_distance):
+    """
+    Levenshtein distance between a and b, or None once it must exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for i, cb in enumerate(b, start=1):
+        current = [i]
+        for j, ca in enumerate(a, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+class FuzzyIndex:
+    """
+    Near-duplicate lookup over translated source strings.
+
+    Strings are normalized (normalize_text) and indexed by character bigram.
+    A lookup derives the largest edit distance the threshold allows, uses the
+    bigram count bound and prefix filtering to scan only the rarest posting
+    lists, and verifies the candidates with a bounded edit distance.
+    Similarity is 1 - distance / longer length. Strings whose numbers differ
+    never match, since their translations would differ too.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.sources = []
+        self.normalized = []
+        self.lengths = array('I')
+        self.postings = {}
+        self.exact = {}
+        self.lookups = 0
+        self.normalized_hits = 0
+        self.fuzzy_hits = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, source):
+        self.extend((source,))
+
+    def extend(self, sources):
+        with self._lock:
+            exact = self.exact
+            postings = self.postings
+            for source in sources:
+                key = normalize_text(source)
+                if key in exact:
+                    continue
+                entry_id = len(self.sources)
+                exact[key] = entry_id
+                self.sources.append(source)
+                self.normalized.append(key)
+                self.lengths.append(len(key))
+                for gram in bigrams(key):
+                    posting = postings.get(gram)
+                    if posting is None:
+                        posting = postings[gram] = array('I')
+                    posting.append(entry_id)
+
+    def _candidates(self, key, max_distance):
+        grams = bigrams(key)
+        # An edit destroys at most two distinct bigrams of the query
+        required = len(grams) - 2 * max_distance
+        if required <= 0:
+            return []
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        # Any string sharing `required` bigrams shares at least one of the rarest len - required + 1
+        candidates = set()
+        for posting in postings[:len(grams) - required + 1]:
+            candidates.update(posting)
+        if len(candidates) > MAX_CANDIDATES:
+            length = len(key)
+            candidates = sorted(candidates, key=lambda entry_id: abs(self.lengths[entry_id] - length))[:MAX_CANDIDATES]
+        return candidates
+
+    def lookup(self, text, is_known=None):
+        """
+        Returns (source, similarity) for the most similar indexed string at or
+        above the threshold, or None. is_known(source) can reject entries that
+        have since been evicted from the translation store.
+        """
+        key = normalize_text(text)
+        with self._lock:
+            self.lookups += 1
+            entry_id = self.exact.get(key)
+            if entry_id is not None and (is_known is None or is_known(self.sources[entry_id])):
+                self.normalized_hits += 1
+                return self.sources[entry_id], 1.0
+            if len(key) < MIN_FUZZY_LENGTH or self.threshold >= 1.0:
+                return None
+            # similarity = 1 - d / max(len), and the match may be up to d longer
+            max_distance = int(len(key) * (1 - self.threshold) / self.threshold)
+            digits = DIGITS_RE.findall(key)
+            best = None
+            for entry_id in self._candidates(key, max_distance):
+                candidate = self.normalized[entry_id]
+                if abs(len(candidate) - len(key)) > max_distance or DIGITS_RE.findall(candidate) != digits:
+                    continue
+                limit = max_distance if best is None else min(max_distance, best[0] - 1)
+                distance = bounded_edit_distance(key, candidate, limit)
+                if distance is None:
+                    continue
+                similarity = 1 - distance / max(len(key), len(candidate))
+                if similarity < self.threshold:
+                    continue
+                if is_known is not None and not is_known(self.sources[entry_id]):
+                    continue
+                best = (distance, entry_id, similarity)
+                if distance == 0:
+                    break
+            if best is None:
+                return None
+            self.fuzzy_hits += 1
+            return self.sources[best[1]], best[2]
+
+    def summary(self):
+        with self._lock:
+            return {
+                'entries': len(self.sources),
+                'threshold': self.threshold,
+                'lookups': self.lookups,
+                'normalized_hits': self.normalized_hits,
+                'fuzzy_hits': self.fuzzy_hits,
+            }
+
+def build_index(threshold, sources):
+    started = time.time()
+    index = FuzzyIndex(threshold)
+    # Building allocates millions of objects, which would otherwise trigger repeated full collections
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        index.extend(sources)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    logger.info(f"Built fuzzy match index of {len(index)} strings in {time.time() - started:.1f}s (threshold {threshold})")
+    return index
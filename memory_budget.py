@@ -0,0 +1,221 @@
+import os
+import sys
+import pickle
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+logger = logging.getLogger('converter')
+
+# Fraction of the budget the translation caches may use together
+CACHE_SHARE = 0.25
+# Part of CACHE_SHARE set aside for translations reused from near-duplicates
+FUZZY_CACHE_SHARE = 0.05
+# Above this fraction of the budget, windows shrink and buffers spill to disk
+PRESSURE_RATIO = 0.75
+SPILL_CHECK_EVERY = 1000
+
+_limit = None
+
+def parse_size(value):
+    """
+    Parses sizes like '512', '512M', '2G' or '750k'; plain numbers are megabytes.
+    Returns bytes.
+    """
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = str(value).strip().lower().rstrip('b')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value) * units['m'])
+
+def set_memory_limit(limit_bytes):
+    global _limit
+    _limit = limit_bytes
+    if limit_bytes:
+        logger.info(f"Memory budget set to {limit_bytes / 1024 / 1024:.0f} MB")
+
+def get_memory_limit():
+    return _limit
+
+def current_memory():
+    """
+    Returns the resident set size of this process in bytes, or 0 if it cannot
+    be measured on this platform.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except Exception:
+            pass
+        return 0
+    try:
+        import resource
+        # Peak rather than current RSS, which errs on the side of shrinking early
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except Exception:
+        return 0
+
+def memory_pressure():
+    """
+    Returns current memory use as a fraction of the budget (0 when unlimited).
+    """
+    if not _limit:
+        return 0.0
+    return current_memory() / _limit
+
+def under_pressure():
+    return memory_pressure() >= PRESSURE_RATIO
+
+def window_rows(default):
+    """
+    Row window size for translation: the default until memory use passes
+    PRESSURE_RATIO of the budget, then shrinking linearly down to one row.
+    """
+    pressure = memory_pressure()
+    if pressure < PRESSURE_RATIO:
+        return default
+    scale = max(0.0, (1.0 - pressure) / (1.0 - PRESSURE_RATIO))
+    return max(1, int(default * scale))
+
+class SizedCache(MutableMapping):
+    """
+    Dict-like LRU cache bounded by the measured size of its keys and values.
+    The bound is `share` of the memory budget and is unbounded without one.
+    """
+
+    def __init__(self, share=CACHE_SHARE):
+        self.share = share
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _entry_size(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value)
+
+    def max_bytes(self):
+        return int(_limit * self.share) if _limit else None
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.size -= self._entry_size(key, self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.size += self._entry_size(key, value)
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self.size -= self._entry_size(key, self._data.pop(key))
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        max_bytes = self.max_bytes()
+        if max_bytes is None:
+            return
+        while self.size > max_bytes and self._data:
+            key, value = self._data.popitem(last=False)
+            self.size -= self._entry_size(key, value)
+            self.evictions += 1
+
+class SpillBuffer:
+    """
+    Append-only sequence of rows that moves its contents to a temporary file
+    whenever the process is under memory pressure. Iterating yields all rows
+    in insertion order; appending while iterating is not supported.
+    """
+
+    def __init__(self):
+        self._rows = []
+        self._file = None
+        self._batches = 0
+        self._spilled = 0
+        self._since_check = 0
+
+    def append(self, row):
+        self._rows.append(row)
+        self._maybe_spill(1)
+
+    def extend(self, rows):
+        count = len(self._rows)
+        self._rows.extend(rows)
+        self._maybe_spill(len(self._rows) - count)
+
+    def _maybe_spill(self, added):
+        if not _limit:
+            return
+        self._since_check += added
+        if self._since_check >= SPILL_CHECK_EVERY:
+            self._since_check = 0
+            if under_pressure():
+                self.spill()
+
+    def spill(self):
+        if not self._rows:
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='hermes_spill_')
+        self._file.seek(0, os.SEEK_END)
+        pickle.dump(self._rows, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._batches += 1
+        self._spilled += len(self._rows)
+        logger.debug(f"Spilled {len(self._rows)} rows to disk ({self._spilled} total)")
+        self._rows = []
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def __len__(self):
+        return self._spilled + len(self._rows)
+
+    def __iter__(self):
+        if self._file is not None:
+            self._file.seek(0)
+            for _ in range(self._batches):
+                yield from pickle.load(self._file)
+        yield from self._rows
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._rows = []
@@ -0,0 +1,233 @@
+import os
+import io
+import csv
+import json
+import time
+import logging
+from translation_utils import contains_chinese, known_translation, fuzzy_translation
+from encoding_utils import decode_mixed_encoding_file, decode_mixed_encoding_lines, detect_encoding_bytes, encoding_display_name
+from encoding_detection import detector, detect_file_encoding
+from csv_processing import find_csv_files, find_archives, load_progress, output_encoding_for, CHUNKED_THRESHOLD_BYTES, TRANSLATION_WORKERS
+
+logger = logging.getLogger('converter')
+
+PLAN_FILE = 'hermes_plan.json'
+PLAN_VERSION = 1
+
+def chinese_cells(rows, start_row=0):
+    """
+    Returns (has_chinese, chinese_strings) where chinese_strings are the
+    Chinese cells past start_row.
+    """
+    chinese_strings = []
+    has_chinese = False
+    for row_idx, row in enumerate(rows):
+        for cell in row:
+            if cell.strip() != "" and contains_chinese(cell):
+                has_chinese = True
+                if row_idx >= start_row:
+                    chinese_strings.append(cell)
+    return has_chinese, chinese_strings
+
+def scan_file(file_path, start_row=0):
+    """
+    Cheap per-file scan: encoding detection and Chinese cell census, no translation.
+    Returns (entry, chinese_strings) where chinese_strings are the cells past
+    start_row that still need translating.
+    """
+    stat = os.stat(file_path)
+    encoding = detect_file_encoding(file_path)
+    decoded_lines = decode_mixed_encoding_file(file_path, encoding)
+    rows = list(csv.reader(io.StringIO('\n'.join(decoded_lines))))
+    has_chinese, chinese_strings = chinese_cells(rows, start_row)
+    entry = {
+        'path': file_path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'encoding': encoding,
+        'encoding_name': encoding_display_name(encoding),
+        'rows': len(rows),
+        'start_row': start_row,
+        'contains_chinese': has_chinese,
+        'chinese_cells': len(chinese_strings),
+    }
+    return entry, chinese_strings
+
+def scan_archive(archive_path):
+    """
+    Chinese cell census of the CSV members of an archive, read one member at
+    a time the way process_archive decodes them. Members in an encoding the
+    run would copy unchanged are skipped.
+    Returns (entry, chinese_strings).
+    """
+    from archive_io import iter_csv_members
+    members = 0
+    largest = 0
+    chinese_strings = []
+    for name, data in iter_csv_members(archive_path):
+        encoding = detect_encoding_bytes(data)
+        if output_encoding_for(encoding_display_name(encoding)) is None:
+            continue
+        members += 1
+        largest = max(largest, len(data))
+        decoded_lines = decode_mixed_encoding_lines(io.BytesIO(data).readlines(), name, encoding_hint=encoding)
+        del data
+        chinese_strings.extend(chinese_cells(csv.reader(io.StringIO('\n'.join(decoded_lines))))[1])
+    entry = {
+        'path': archive_path,
+        'size': os.path.getsize(archive_path),
+        'members': members,
+        'largest_member': largest,
+        'chinese_cells': len(chinese_strings),
+    }
+    return entry, chinese_strings
+
+def build_plan(root_dir='.', workers=TRANSLATION_WORKERS, avg_latency=1.0):
+    """
+    Scans root_dir and the archives in it and estimates the work a real run
+    would do. Translation is one backend call per unique uncached string,
+    made for the first file that holds it. Files are processed one after
+    another; small files translate one call at a time and files at or above
+    CHUNKED_THRESHOLD_BYTES translate with `workers` concurrent windows.
+    Archive members convert concurrently on `workers` threads. Each file's
+    wall time is its calls * avg_latency / its concurrency.
+    """
+    started = time.time()
+    progress = load_progress()
+    files = []
+    archives = []
+    encodings = {}
+    total_chinese_cells = 0
+    unique_strings = set()
+    totals = {'cached': 0, 'fuzzy': 0, 'api_calls': 0, 'seconds': 0.0}
+    workers = max(1, workers)
+
+    def estimate(entry, chinese_strings, concurrency):
+        new_strings = set(chinese_strings) - unique_strings
+        unique_strings.update(new_strings)
+        cached = sum(1 for text in new_strings if known_translation(text) is not None)
+        # Zero unless fuzzy matching is enabled
+        fuzzy = sum(1 for text in new_strings if known_translation(text) is None and fuzzy_translation(text) is not None)
+        api_calls = len(new_strings) - cached - fuzzy
+        entry['estimated_api_calls'] = api_calls
+        entry['concurrency'] = concurrency
+        entry['estimated_seconds'] = round(api_calls * avg_latency / concurrency, 1)
+        totals['cached'] += cached
+        totals['fuzzy'] += fuzzy
+        totals['api_calls'] += api_calls
+        totals['seconds'] += api_calls * avg_latency / concurrency
+
+    if os.path.isfile(root_dir):
+        file_paths, archive_paths = [], [root_dir]
+    else:
+        file_paths, archive_paths = find_csv_files(root_dir), find_archives(root_dir)
+    for file_path in file_paths:
+        try:
+            entry, chinese_strings = scan_file(file_path, start_row=progress.get(file_path, 0))
+        except Exception as e:
+            logger.error(f"Error scanning file {file_path} for plan: {e}")
+            continue
+        bucket = encodings.setdefault(entry['encoding_name'] or 'UNKNOWN', {'files': 0, 'bytes': 0})
+        bucket['files'] += 1
+        bucket['bytes'] += entry['size']
+        total_chinese_cells += len(chinese_strings)
+        estimate(entry, chinese_strings, workers if entry['size'] >= CHUNKED_THRESHOLD_BYTES else 1)
+        files.append(entry)
+    detector.save()
+
+    # Archives are processed after the plain files
+    for archive_path in archive_paths:
+        try:
+            entry, chinese_strings = scan_archive(archive_path)
+        except Exception as e:
+            logger.error(f"Error scanning archive {archive_path} for plan: {e}")
+            continue
+        total_chinese_cells += len(chinese_strings)
+        single = entry['members'] <= 1 and entry['largest_member'] < CHUNKED_THRESHOLD_BYTES
+        estimate(entry, chinese_strings, 1 if single else workers)
+        archives.append(entry)
+
+    unique_chars = set()
+    for text in unique_strings:
+        unique_chars.update(ch for ch in text if contains_chinese(ch))
+
+    return {
+        'version': PLAN_VERSION,
+        'root_dir': root_dir,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scan_seconds': round(time.time() - started, 3),
+        'total_files': len(files),
+        'total_bytes': sum(entry['size'] for entry in files),
+        'total_archives': len(archives),
+        'archive_members': sum(entry['members'] for entry in archives),
+        'encodings': encodings,
+        'chinese_cells': total_chinese_cells,
+        'unique_strings': len(unique_strings),
+        'unique_chars': len(unique_chars),
+        'cached_strings': totals['cached'],
+        'cache_hit_rate': round(totals['cached'] / len(unique_strings), 4) if unique_strings else 1.0,
+        'fuzzy_strings': totals['fuzzy'],
+        'estimated_api_calls': totals['api_calls'],
+        'workers': workers,
+        'avg_latency': avg_latency,
+        'estimated_seconds': round(totals['seconds'], 1),
+        'files': files,
+        'archives': archives,
+    }
+
+def save_plan(plan, plan_file=PLAN_FILE):
+    with open(plan_file, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+
+def load_plan(plan_file=PLAN_FILE):
+    try:
+        with open(plan_file, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except Exception as e:
+        logger.error(f"Failed to load plan file {plan_file}: {e}")
+        return None
+    if plan.get('version') != PLAN_VERSION:
+        logger.warning(f"Plan file {plan_file} has unsupported version {plan.get('version')}, ignoring it.")
+        return None
+    plan['files_by_path'] = {entry['path']: entry for entry in plan.get('files', [])}
+    return plan
+
+def planned_file_entry(plan, file_path):
+    """
+    Returns the plan entry for file_path if the file is unchanged since the
+    plan was made, otherwise None so the caller rescans it.
+    """
+    entry = plan.get('files_by_path', {}).get(file_path)
+    if entry is None:
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+        logger.debug(f"Plan entry for {file_path} is stale, rescanning")
+        return None
+    return entry
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}h {minutes:02d}m {secs:02d}s"
+
+def log_plan(plan):
+    logger.info(f"Plan for {plan['root_dir']}: {plan['total_files']} files, {plan['total_bytes']} bytes (scanned in {plan['scan_seconds']}s)")
+    for name, bucket in sorted(plan['encodings'].items()):
+        logger.info(f"  {name}: {bucket['files']} files, {bucket['bytes']} bytes")
+    if plan['total_archives']:
+        logger.info(f"  Archives: {plan['total_archives']} with {plan['archive_members']} CSV members")
+    logger.info(f"  Chinese cells to translate: {plan['chinese_cells']}")
+    logger.info(f"  Unique strings: {plan['unique_strings']}, unique characters: {plan['unique_chars']}")
+    logger.info(f"  Expected cache hit rate: {plan['cache_hit_rate'] * 100:.1f}% ({plan['cached_strings']} strings)")
+    if plan.get('fuzzy_strings'):
+        logger.info(f"  Resolved by fuzzy matching: {plan['fuzzy_strings']} strings")
+    logger.info(f"  Estimated API calls: {plan['estimated_api_calls']}")
+    entries = plan['files'] + plan['archives']
+    large = sum(1 for entry in entries if entry['concurrency'] > 1)
+    logger.info(f"  Estimated wall time: {format_duration(plan['estimated_seconds'])} "
+                f"({len(entries) - large} files or archives one call at a time, {large} with {plan['workers']} workers)")
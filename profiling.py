@@ -0,0 +1,238 @@
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+import contextlib
+
+logger = logging.getLogger('converter')
+
+PROFILE_DIR = 'hermes_profile'
+TOP_ALLOCATIONS = 10
+COLLAPSED_MAX_DEPTH = 64
+
+_profiler = None
+
+class StageRecord:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0        # inclusive wall time
+        self.exclusive = 0.0   # wall time minus nested stages
+        self.peak_memory = 0
+        self.stats = None
+        self.top_allocations = []
+
+class RunProfiler:
+    """
+    Collects cProfile stats, wall time and tracemalloc peaks per file and stage.
+    Each file's stats are written as .pstats and appended to profile.collapsed
+    (flamegraph.pl / speedscope input) as soon as the next file starts.
+
+    Stages may nest; the enclosing stage's profiler is paused while a nested
+    stage runs, so every stage's stats are exclusive of its children. Only the
+    main thread is profiled, work handed to thread or process pools shows up
+    as wall time of the stage that waits on it.
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.output_dir = output_dir
+        self.files = {}
+        self.file_order = []
+        self.current_file = None
+        self._stack = []
+        os.makedirs(output_dir, exist_ok=True)
+        self.collapsed_path = os.path.join(output_dir, 'profile.collapsed')
+        open(self.collapsed_path, 'w').close()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def begin_file(self, file_path):
+        if self.current_file is not None:
+            self.end_file()
+        self.current_file = file_path
+        self.file_order.append(file_path)
+        self.files[file_path] = {}
+
+    def end_file(self):
+        file_path = self.current_file
+        self.current_file = None
+        if file_path is None or not self.files.get(file_path):
+            return
+        self._write_file_stats(file_path)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.current_file is None or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            parent['profile'].disable()
+            parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        frame = {'profile': cProfile.Profile(), 'peak': 0, 'children': 0.0, 'file': self.current_file}
+        self._stack.append(frame)
+        started = time.perf_counter()
+        frame['profile'].enable()
+        try:
+            yield
+        finally:
+            frame['profile'].disable()
+            elapsed = time.perf_counter() - started
+            self._stack.pop()
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            self._record(frame, name, elapsed, peak)
+            if parent is not None:
+                parent['peak'] = max(parent['peak'], peak)
+                parent['children'] += elapsed
+                parent['profile'].enable()
+
+    def _record(self, frame, name, elapsed, peak):
+        record = self.files.setdefault(frame['file'], {}).setdefault(name, StageRecord())
+        record.calls += 1
+        record.wall += elapsed
+        record.exclusive += elapsed - frame['children']
+        if peak >= record.peak_memory:
+            record.peak_memory = peak
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ])
+            record.top_allocations = [
+                {'location': str(stat.traceback), 'size': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+        stats = pstats.Stats(frame['profile'])
+        if record.stats is None:
+            record.stats = stats
+        else:
+            record.stats.add(stats)
+
+    def _file_prefix(self, file_path):
+        index = self.file_order.index(file_path) + 1
+        safe_name = re.sub(r'[^\w.-]+', '_', os.path.basename(file_path))
+        return os.path.join(self.output_dir, f"{index:04d}_{safe_name}")
+
+    def _write_file_stats(self, file_path):
+        prefix = self._file_prefix(file_path)
+        combined = None
+        for name, record in self.files[file_path].items():
+            record.stats.dump_stats(f"{prefix}.{name}.pstats")
+            if combined is None:
+                combined = pstats.Stats(f"{prefix}.{name}.pstats")
+            else:
+                combined.add(f"{prefix}.{name}.pstats")
+        combined.dump_stats(f"{prefix}.pstats")
+
+        # Stats objects are large, so stacks are flushed per file and the stats dropped
+        with open(self.collapsed_path, 'a', encoding='utf-8') as f:
+            for name, record in self.files[file_path].items():
+                root = f"{_frame_label(file_path)};{name}"
+                for stack, seconds in _collapse(record.stats.stats):
+                    micros = int(seconds * 1e6)
+                    if micros > 0:
+                        f.write(f"{root};{stack} {micros}\n")
+                record.stats = None
+
+    def summary(self):
+        files = []
+        for file_path in self.file_order:
+            stages = self.files.get(file_path, {})
+            if not stages:
+                continue
+            ranked = sorted(stages.items(), key=lambda item: item[1].exclusive, reverse=True)
+            files.append({
+                'file': file_path,
+                'wall': round(sum(record.exclusive for record in stages.values()), 4),
+                'dominant_stage': ranked[0][0],
+                'peak_memory': max(record.peak_memory for record in stages.values()),
+                'stages': {
+                    name: {
+                        'calls': record.calls,
+                        'wall': round(record.wall, 4),
+                        'exclusive': round(record.exclusive, 4),
+                        'peak_memory': record.peak_memory,
+                        'top_allocations': record.top_allocations,
+                    }
+                    for name, record in ranked
+                },
+            })
+        files.sort(key=lambda entry: entry['wall'], reverse=True)
+        return files
+
+    def finish(self, top=10):
+        self.end_file()
+        summary = self.summary()
+        summary_path = os.path.join(self.output_dir, 'summary.json')
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+        logger.info(f"Profile written to {self.output_dir} (collapsed stacks: {self.collapsed_path})")
+        for rank, entry in enumerate(summary[:top], start=1):
+            dominant = entry['stages'][entry['dominant_stage']]
+            logger.info(f"{rank}. {entry['file']}: {entry['wall']:.2f}s, dominant stage {entry['dominant_stage']} "
+                        f"({dominant['exclusive']:.2f}s), peak memory {entry['peak_memory'] / 1024 / 1024:.1f} MB")
+
+def _frame_label(value):
+    return str(value).replace(';', ':').replace('\n', ' ')
+
+def _function_label(func):
+    filename, lineno, funcname = func
+    if filename == '~':
+        return _frame_label(funcname)
+    return _frame_label(f"{os.path.basename(filename)}:{funcname}:{lineno}")
+
+def _collapse(stats):
+    """
+    cProfile only keeps caller/callee pairs, so stacks are rebuilt from the
+    call graph by splitting each function's time across its callers.
+    Returns (stack, seconds) pairs.
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, entry in stats.items() if not entry[4]]
+
+    results = {}
+    def walk(func, path, share):
+        cc, nc, tt, ct, _ = stats[func]
+        fraction = share / ct if ct else 0.0
+        path = path + [_function_label(func)]
+        stack = ';'.join(path)
+        results[stack] = results.get(stack, 0.0) + tt * fraction
+        if len(path) >= COLLAPSED_MAX_DEPTH:
+            return
+        for child, edge_ct in children.get(func, []):
+            child_share = edge_ct * fraction
+            if child_share > 1e-6 and _function_label(child) not in path:
+                walk(child, path, child_share)
+
+    for root in roots:
+        walk(root, [], stats[root][3])
+    return results.items()
+
+def enable_profiling(output_dir=PROFILE_DIR):
+    global _profiler
+    _profiler = RunProfiler(output_dir)
+    logger.info(f"Profiling enabled, writing results to {output_dir}")
+    return _profiler
+
+def finish_profiling():
+    global _profiler
+    if _profiler is not None:
+        _profiler.finish()
+        _profiler = None
+
+def profile_file(file_path):
+    if _profiler is not None:
+        _profiler.begin_file(file_path)
+
+def profile_stage(name):
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
@@ -0,0 +1,247 @@
+import os
+import io
+import csv
+import json
+import time
+import logging
+import tempfile
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import translation_utils
+from translation_utils import SingleFlight, contains_chinese, batch_translate_texts, known_translation, fuzzy_translation, translation_cache, translation_memory, scheduler
+from encoding_utils import detect_encoding, decode_mixed_encoding_file
+
+logger = logging.getLogger('converter')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class TokenBucket:
+    """
+    Central translator budget: `rate` calls per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n=1):
+        """
+        Takes n tokens if available. Returns (True, 0) on success, otherwise
+        (False, seconds until n tokens will be available).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if n <= self._tokens:
+                self._tokens -= n
+                return True, 0
+            return False, (n - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+
+def _known_or_original(cell):
+    if not isinstance(cell, str):
+        return cell
+    known = known_translation(cell)
+    return cell if known is None else known
+
+
+class TranslationService:
+    def __init__(self, rate=2.0, burst=50, workers=4):
+        self.bucket = TokenBucket(rate, burst)
+        self.flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {'requests': 0, 'cells': 0, 'chinese_cells': 0, 'cache_hits': 0, 'fuzzy_hits': 0,
+                      'coalesced': 0, 'cache_misses': 0, 'rejected': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **kwargs):
+        with self._stats_lock:
+            for key, value in kwargs.items():
+                self.stats[key] += value
+
+    def _admit(self, cost):
+        if cost > self.bucket.capacity:
+            raise ValueError(f"request needs {cost} translator calls, more than the burst budget of {int(self.bucket.capacity)}; split it into smaller requests")
+        return self.bucket.try_acquire(cost) if cost else (True, 0)
+
+    def translate_cells(self, cells):
+        """
+        Translates a list of cells through the shared cache.
+        Returns (translated_cells, retry_after); retry_after is set and no work
+        is done when the translator budget cannot cover the uncached cells.
+
+        Only Chinese string cells are counted in the stats: each is a cache
+        hit, a fuzzy hit, a miss (one translator call) or coalesced into a
+        call made for an identical cell of this or another request.
+        """
+        counts = collections.Counter(cell for cell in cells if isinstance(cell, str) and cell.strip() != "" and contains_chinese(cell))
+        pending = []
+        cache_hits = fuzzy_hits = 0
+        for cell, count in counts.items():
+            if known_translation(cell) is not None:
+                cache_hits += count
+                continue
+            # Near-duplicates of translated strings cost no translator budget
+            fuzzy = fuzzy_translation(cell)
+            if fuzzy is not None:
+                translation_utils.fuzzy_cache[cell] = fuzzy
+                fuzzy_hits += count
+                continue
+            pending.append(cell)
+
+        # Leadership is claimed and charged in one step, so only strings this
+        # request will actually send cost budget; strings already in flight
+        # for another request are waited on for free
+        claims, retry_after = self.flight.claim(pending, admit=self._admit)
+        if claims is None:
+            self._count(requests=1, rejected=1)
+            return None, retry_after
+
+        # Only leaders occupy the pool, so a follower can never block the call it waits for
+        futures = {key: self.executor.submit(self.flight.run, key, call, lambda text=key: batch_translate_texts([text])[0])
+                   for key, call, leader in claims if leader}
+        results = {key: futures[key].result() if leader else self.flight.wait(call) for key, call, leader in claims}
+        translated = [results[cell] if cell in results else _known_or_original(cell) for cell in cells]
+        misses = len(futures)
+        self._count(requests=1, cells=len(cells), chinese_cells=sum(counts.values()), cache_hits=cache_hits,
+                    fuzzy_hits=fuzzy_hits, coalesced=sum(counts[cell] for cell in pending) - misses, cache_misses=misses)
+        return translated, 0
+
+    def convert_csv(self, data, output_encoding, do_translate=True):
+        """
+        Runs the regular conversion pipeline over an uploaded CSV.
+        Chinese cells are resolved through translate_cells, which is charged
+        to the translator budget; the translated rows are then written here,
+        so cells every translator failed on are not sent again uncharged.
+        Returns (csv_bytes, retry_after).
+        """
+        from csv_processing import convert_and_translate_csv, convert_row, find_mojibake_columns, open_output
+        from encoding_utils import repair_mojibake_rows
+        fd, input_path = tempfile.mkstemp(suffix='.csv')
+        output_path = input_path + '.out'
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            input_encoding = detect_encoding(input_path) or 'utf-8'
+            if do_translate:
+                rows = list(csv.reader(io.StringIO('\n'.join(decode_mixed_encoding_file(input_path, input_encoding)))))
+                repair_mojibake_rows(rows, find_mojibake_columns(rows, 'upload', output_encoding))
+                translated, retry_after = self.translate_cells([cell for row in rows for cell in row])
+                if translated is None:
+                    return None, retry_after
+                cells = iter(translated)
+                with open_output(output_path, output_encoding) as f_out:
+                    csv.writer(f_out).writerows(convert_row([next(cells) for _ in row], output_encoding) for row in rows)
+            elif not convert_and_translate_csv(input_path, output_path, input_encoding, output_encoding, do_translate=False):
+                raise ValueError("conversion failed")
+            with open(output_path, 'rb') as f:
+                return f.read(), 0
+        finally:
+            for path in (input_path, output_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def snapshot_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['cache_size'] = len(translation_cache)
+        stats['memory_size'] = len(translation_memory)
+        stats['translators'] = scheduler.summary()
+        if translation_utils.fuzzy_index is not None:
+            stats['fuzzy'] = translation_utils.fuzzy_index.summary()
+        return stats
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if content_type == 'application/json':
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _busy(self, retry_after):
+        retry_after = max(1, int(retry_after + 0.999)) if retry_after != float('inf') else 60
+        self._send(429, {'error': 'translator budget exhausted', 'retry_after': retry_after}, headers={'Retry-After': str(retry_after)})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"request body larger than {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            self._send(200, self.service.snapshot_stats())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            body = self._read_body()
+            if url.path == '/translate':
+                payload = json.loads(body.decode('utf-8') or '{}')
+                cells = payload.get('cells')
+                if not isinstance(cells, list):
+                    self._send(400, {'error': "expected JSON object with a 'cells' list"})
+                    return
+                translated, retry_after = self.service.translate_cells(cells)
+                if translated is None:
+                    self._busy(retry_after)
+                    return
+                self._send(200, {'cells': translated})
+            elif url.path == '/convert':
+                output_encoding = params.get('output_encoding', ['utf-8'])[0]
+                do_translate = params.get('translate', ['1'])[0] not in ('0', 'false', 'no')
+                data, retry_after = self.service.convert_csv(body, output_encoding, do_translate=do_translate)
+                if data is None:
+                    self._busy(retry_after)
+                    return
+                self._send(200, data, content_type=f'text/csv; charset={output_encoding}')
+            else:
+                self._send(404, {'error': 'not found'})
+        except Exception as e:
+            logger.error(f"Service error on {url.path}: {e}")
+            self._send(400, {'error': str(e)})
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, rate=2.0, burst=50, workers=4):
+    """
+    Serves the translation/conversion endpoints until interrupted:
+
+    POST /translate                  {"cells": [...]} -> {"cells": [...]}
+    POST /convert?output_encoding=   raw CSV body -> converted CSV
+    GET  /stats                      cache and budget counters
+    """
+    service = TranslationService(rate=rate, burst=burst, workers=workers)
+    handler = type('BoundServiceHandler', (ServiceHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info(f"Hermes service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False)
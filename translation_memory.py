@@ -0,0 +1,186 @@
+import os
+import json
+import logging
+from xml.sax.saxutils import escape, quoteattr
+from xml.etree.ElementTree import iterparse
+from translation_utils import translation_cache, translation_memory
+
+logger = logging.getLogger('converter')
+
+ORIGIN_REVIEWED = 'reviewed'
+ORIGIN_MACHINE = 'machine'
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+IMPORT_BATCH = 10000
+
+def detect_format(path):
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    for ext, fmt in (('.jsonl', 'jsonl'), ('.ndjson', 'jsonl'), ('.tsv', 'tsv'), ('.tmx', 'tmx')):
+        if name.endswith(ext):
+            return fmt
+    raise ValueError(f"Cannot tell translation memory format of {path}; use .jsonl, .tsv or .tmx")
+
+def _open_text(path, mode, compressed=None):
+    if compressed is None:
+        compressed = path.lower().endswith('.gz')
+    if compressed:
+        import gzip
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def _tsv_escape(text):
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _tsv_unescape(text):
+    if '\\' not in text:
+        return text
+    out = []
+    chars = iter(text)
+    for ch in chars:
+        if ch == '\\':
+            nxt = next(chars, '')
+            out.append({'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}.get(nxt, '\\' + nxt))
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+def iter_jsonl(path):
+    """
+    Yields (source, target, origin) from lines like
+    {"source": "...", "target": "...", "origin": "reviewed"}; origin is optional.
+    """
+    with _open_text(path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record['source'], record['target'], record.get('origin', ORIGIN_REVIEWED)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping line {line_no} of {path}: {e}")
+
+def iter_tsv(path):
+    """
+    Yields (source, target, origin) from source<TAB>target[<TAB>origin] lines,
+    with tabs, newlines and backslashes escaped as \\t, \\n and \\\\.
+    """
+    with _open_text(path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            parts = line.split('\t')
+            if len(parts) < 2:
+                logger.warning(f"Skipping line {line_no} of {path}: expected source and target separated by a tab")
+                continue
+            origin = parts[2] if len(parts) > 2 else ORIGIN_REVIEWED
+            yield _tsv_unescape(parts[0]), _tsv_unescape(parts[1]), origin
+
+def iter_tmx(path, source_lang='zh', target_lang='en'):
+    """
+    Yields (source, target, origin) from the <tu> units of a TMX file, matching
+    <tuv xml:lang> by prefix. Parsed incrementally, so memory stays flat.
+    """
+    if path.lower().endswith('.gz'):
+        import gzip
+        opener = gzip.open
+    else:
+        opener = open
+    with opener(path, 'rb') as f:
+        # Open elements, so each finished <tu> can be detached from its parent (<body>)
+        stack = []
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag != 'tu':
+                continue
+            segments = {}
+            for tuv in elem.iter('tuv'):
+                lang = (tuv.get(XML_LANG) or tuv.get('lang') or '').lower()
+                seg = tuv.find('seg')
+                if seg is not None:
+                    segments[lang] = ''.join(seg.itertext())
+            source = next((text for lang, text in segments.items() if lang.startswith(source_lang)), None)
+            target = next((text for lang, text in segments.items() if lang.startswith(target_lang)), None)
+            origin = next((prop.text for prop in elem.iter('prop') if prop.get('type') == 'origin'), None)
+            if source is not None and target is not None:
+                yield source, target, origin or ORIGIN_REVIEWED
+            elem.clear()
+            if stack:
+                # An emptied <tu> would otherwise stay attached, one per unit
+                del stack[-1][:]
+
+READERS = {'jsonl': iter_jsonl, 'tsv': iter_tsv, 'tmx': iter_tmx}
+
+def import_translation_memory(path, fmt=None):
+    """
+    Streams translation pairs from path into the translation store.
+    Reviewed pairs go into translation_memory and take precedence over machine
+    output; pairs marked as machine origin only warm translation_cache.
+
+    Returns the number of pairs imported.
+    """
+    fmt = fmt or detect_format(path)
+    reviewed = {}
+    machine = {}
+    count = 0
+    for source, target, origin in READERS[fmt](path):
+        if not isinstance(source, str) or not isinstance(target, str):
+            continue
+        (machine if origin == ORIGIN_MACHINE else reviewed)[source] = target
+        count += 1
+        if count % IMPORT_BATCH == 0:
+            translation_memory.update(reviewed)
+            translation_cache.update(machine)
+            reviewed.clear()
+            machine.clear()
+    translation_memory.update(reviewed)
+    translation_cache.update(machine)
+    logger.info(f"Imported {count} translation pairs from {path} ({len(translation_memory)} reviewed, {len(translation_cache)} cached in total)")
+    return count
+
+def iter_store(include_machine=True):
+    """
+    Yields (source, target, origin) for the whole translation store. Machine
+    entries that are overridden by a reviewed pair, or that just echo their
+    source (untranslated or failed), are skipped.
+    """
+    for source, target in list(translation_memory.items()):
+        yield source, target, ORIGIN_REVIEWED
+    if include_machine:
+        for source in list(translation_cache):
+            target = translation_cache.get(source)
+            if source is None or target is None or source == target or source in translation_memory:
+                continue
+            yield source, target, ORIGIN_MACHINE
+
+def export_translation_memory(path, fmt=None, include_machine=True, source_lang='zh-CN', target_lang='en'):
+    """
+    Writes the translation store to path, atomically replacing it.
+    Returns the number of pairs written.
+    """
+    fmt = fmt or detect_format(path)
+    temp_path = f"{path}.part"
+    count = 0
+    with _open_text(temp_path, 'w', compressed=path.lower().endswith('.gz')) as f:
+        if fmt == 'tmx':
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tmx version="1.4">\n')
+            f.write(f'<header creationtool="Hermes" segtype="sentence" datatype="plaintext" adminlang="en" srclang={quoteattr(source_lang)} o-tmf="hermes"/>\n<body>\n')
+        for source, target, origin in iter_store(include_machine):
+            if fmt == 'jsonl':
+                f.write(json.dumps({'source': source, 'target': target, 'origin': origin}, ensure_ascii=False) + '\n')
+            elif fmt == 'tsv':
+                f.write(f"{_tsv_escape(source)}\t{_tsv_escape(target)}\t{origin}\n")
+            else:
+                f.write(f'<tu><prop type="origin">{origin}</prop>'
+                        f'<tuv xml:lang={quoteattr(source_lang)}><seg>{escape(source)}</seg></tuv>'
+                        f'<tuv xml:lang={quoteattr(target_lang)}><seg>{escape(target)}</seg></tuv></tu>\n')
+            count += 1
+        if fmt == 'tmx':
+            f.write('</body>\n</tmx>\n')
+    os.replace(temp_path, path)
+    logger.info(f"Exported {count} translation pairs to {path}")
+    return count
@@ -1,6 +1,11 @@
 import time
 import requests
 import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from memory_budget import SizedCache, CACHE_SHARE, FUZZY_CACHE_SHARE
+from fuzzy_match import build_index
 
 try:
     from googletrans import Translator
@@ -22,7 +27,16 @@ except ImportError:
 
 logger = logging.getLogger('converter')
 
-translation_cache = {}
+# Bounded by measured size when a memory budget is set (--max-memory); together
+# with fuzzy_cache it stays within CACHE_SHARE of the budget
+translation_cache = SizedCache(share=CACHE_SHARE - FUZZY_CACHE_SHARE)
+# Imported, human-reviewed pairs; they take precedence over machine output and are never evicted
+translation_memory = {}
+# Near-duplicate index over the translation store, enabled with enable_fuzzy_matching
+fuzzy_index = None
+# Translations reused from near-duplicates; kept apart from translation_cache so
+# they are never exported to a translation memory or indexed as sources
+fuzzy_cache = SizedCache(share=FUZZY_CACHE_SHARE)
 
 def get_active_translators():
     return [
@@ -30,13 +44,66 @@ def get_active_translators():
         "Backup Translator (translate package)"
     ]
 
+def stored_translation(text):
+    """
+    Returns the reviewed translation of text if there is one, otherwise the
+    cached machine translation, otherwise None.
+    """
+    if text in translation_memory:
+        return translation_memory[text]
+    return translation_cache.get(text)
+
+def known_translation(text):
+    """
+    Like stored_translation, falling back to a translation reused from a
+    near-duplicate.
+    """
+    known = stored_translation(text)
+    if known is None:
+        return fuzzy_cache.get(text)
+    return known
+
+def _is_reusable(source):
+    target = stored_translation(source)
+    return target is not None and target != source
+
+def enable_fuzzy_matching(threshold):
+    """
+    Indexes the current translation store so strings within threshold
+    similarity of a translated one reuse its translation instead of calling a
+    backend. Strings translated later are added as they arrive.
+    """
+    global fuzzy_index
+    sources = [source for source in list(translation_memory) + list(translation_cache) if _is_reusable(source)]
+    fuzzy_index = build_index(threshold, sources)
+    return fuzzy_index
+
+def index_translation(source):
+    if fuzzy_index is not None and _is_reusable(source):
+        fuzzy_index.add(source)
+
+def fuzzy_translation(text):
+    """
+    Returns the translation of the most similar indexed string, or None when
+    fuzzy matching is off or nothing is close enough.
+    """
+    if fuzzy_index is None:
+        return None
+    match = fuzzy_index.lookup(text, is_known=_is_reusable)
+    if match is None:
+        return None
+    source, similarity = match
+    logger.debug(f"Reusing translation of {source!r} for {text!r} (similarity {similarity:.2f})")
+    return stored_translation(source)
+
 def contains_chinese(text):
     for ch in text:
         if '\u4e00' <= ch <= '\u9fff':
             return True
     return False
 
-# Define 2 translators as task1 and task2 without retry/backoff to avoid delays
+# Define 2 translators as task1 and task2 without retry/backoff to avoid delays;
+# failover and hedging between them is handled by TranslatorScheduler
 
 import traceback
 
@@ -44,15 +111,9 @@ def task1_translate(text):
     try:
         return translator.translate(text, src='zh-cn', dest='en').text
     except Exception as e:
-        logger.warning(f"Task1 translation error: {e}, retrying once immediately")
+        logger.warning(f"Task1 translation error: {e}")
         logger.debug(traceback.format_exc())
-        try:
-            # Immediate retry once without delay
-            return translator.translate(text, src='zh-cn', dest='en').text
-        except Exception as e2:
-            logger.error(f"Task1 translation error on retry: {e2}")
-            logger.debug(traceback.format_exc())
-            raise
+        raise
 
 def task2_translate(text):
     if not backup_translator_available:
@@ -63,23 +124,292 @@ def task2_translate(text):
         logger.error(f"Task2 translation error: {e}")
         raise
 
-translator_functions = [
-    task1_translate,
-    task2_translate
-]
+translator_functions = [task1_translate]
+# Without the translate package task2 only echoes its input, which would win every hedge
+if backup_translator_available:
+    translator_functions.append(task2_translate)
+
+LATENCY_WINDOW = 200          # recent calls kept per backend
+MIN_LATENCY_SAMPLES = 20      # samples needed before p95 is trusted
+DEFAULT_HEDGE_DELAY = 2.0     # seconds to wait before hedging while p95 is unknown
+MIN_HEDGE_DELAY = 0.05
+UNHEALTHY_AFTER_FAILURES = 3
+UNHEALTHY_COOLDOWN = 30.0     # seconds a failing backend is skipped before being probed again
+TRANSLATE_DEADLINE = 30.0     # seconds a text may take across all backends before it is given up
+
+class BackendStats:
+    """
+    Moving window of successful call latencies and health state for one
+    translator backend.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self, latency):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.unhealthy_until = 0.0
+
+    def record_failure(self):
+        with self.lock:
+            self.calls += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= UNHEALTHY_AFTER_FAILURES:
+                self.unhealthy_until = time.monotonic() + UNHEALTHY_COOLDOWN
+
+    def record_timeout(self):
+        # The call itself is counted when it finally returns
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= UNHEALTHY_AFTER_FAILURES:
+                self.unhealthy_until = time.monotonic() + UNHEALTHY_COOLDOWN
+
+    def healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    def percentile(self, p):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def hedge_delay(self):
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, self.percentile(95))
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'healthy': self.healthy(),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single execution.
+    Callers arriving while a key is in flight wait for and share its result.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def claim(self, keys, admit=None):
+        """
+        Registers the caller for all keys in one step. Keys not in flight are
+        led by the caller, the others join the call already running.
+        admit(led) runs under the lock before anything is registered, so no
+        other caller can take over a key in between; if it returns
+        (False, retry_after) nothing is registered.
+
+        Returns (claims, retry_after) where claims is a list of
+        (key, call, is_leader), or None when admit refused. Every leader must
+        pass its call to run().
+        """
+        with self._lock:
+            led = [key for key in dict.fromkeys(keys) if key not in self._calls]
+            if admit is not None:
+                ok, retry_after = admit(len(led))
+                if not ok:
+                    return None, retry_after
+            claims = []
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = self._Call()
+                    claims.append((key, call, True))
+                else:
+                    self.coalesced += 1
+                    claims.append((key, call, False))
+            return claims, 0
+
+    def run(self, key, call, fn):
+        """
+        Runs fn for a key claimed as leader and hands the result to its followers.
+        """
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    @staticmethod
+    def wait(call):
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn):
+        (_, call, leader), = self.claim([key])[0]
+        return self.run(key, call, fn) if leader else self.wait(call)
+
+
+class TranslatorScheduler:
+    """
+    Sends each text to the fastest healthy backend by median latency. If the
+    call is still running after that backend's p95 latency, a hedged duplicate
+    goes to the next backend and whichever answer arrives first wins. A failed
+    call fails over to the next backend immediately. A text still unanswered
+    after `deadline` seconds raises TimeoutError and the backends it waited on
+    count as failed.
+    """
+
+    def __init__(self, backends, max_workers=16, deadline=TRANSLATE_DEADLINE):
+        self.backends = backends  # shared list, so later changes to translator_functions apply
+        self.deadline = deadline
+        self.stats = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='translator')
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def backend_stats(self, backend):
+        with self.lock:
+            if backend not in self.stats:
+                self.stats[backend] = BackendStats(getattr(backend, '__name__', repr(backend)))
+            return self.stats[backend]
+
+    def ranked_backends(self):
+        def rank(backend):
+            stats = self.backend_stats(backend)
+            # Untried backends sort first so every backend gets latency samples;
+            # a backend that just failed sorts after those that did not
+            median = stats.percentile(50)
+            return (not stats.healthy(), stats.consecutive_failures > 0, -1 if median is None else median)
+        return sorted(self.backends, key=rank)
+
+    def _call(self, backend, text):
+        stats = self.backend_stats(backend)
+        started = time.monotonic()
+        try:
+            result = backend(text)
+        except Exception:
+            stats.record_failure()
+            raise
+        stats.record_success(time.monotonic() - started)
+        return result
+
+    def translate(self, text):
+        remaining = self.ranked_backends()
+        if not remaining:
+            raise RuntimeError("No translator backends configured")
+        pending = {}
+        hedged = False
+        last_error = None
+        deadline = time.monotonic() + self.deadline
+
+        def launch():
+            backend = remaining.pop(0)
+            pending[self.executor.submit(self._call, backend, text)] = backend
+            return backend
+
+        primary = launch()
+        while pending:
+            left = deadline - time.monotonic()
+            hedge_delay = self.backend_stats(primary).hedge_delay() if remaining and not hedged else None
+            timeout = max(0, left if hedge_delay is None else min(hedge_delay, left))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done and timeout >= left:
+                # A hung call cannot be interrupted; it keeps its worker until it returns
+                for future, backend in pending.items():
+                    future.cancel()
+                    self.backend_stats(backend).record_timeout()
+                raise TimeoutError(f"no translator answered within {self.deadline:.0f}s")
+            if not done:
+                backend = launch()
+                hedged = True
+                with self.lock:
+                    self.hedges += 1
+                logger.debug(f"Hedging translation to {self.backend_stats(backend).name} after {timeout:.2f}s")
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if hedged and backend is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                # Slower duplicates keep running and still feed the latency stats
+                return result
+            if not pending and remaining:
+                launch()
+        raise last_error
+
+    def summary(self):
+        with self.lock:
+            backends = list(self.stats.values())
+            summary = {'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+        summary['backends'] = {stats.name: stats.summary() for stats in backends}
+        return summary
+
+scheduler = TranslatorScheduler(translator_functions)
+# Concurrent windows and archive members translating the same string share one call
+translation_flight = SingleFlight()
+
+def log_translator_stats():
+    summary = scheduler.summary()
+    for name, stats in summary['backends'].items():
+        latencies = ', '.join(f"{p}={stats[p]:.2f}s" for p in ('p50', 'p95', 'p99') if stats[p] is not None)
+        logger.info(f"Translator {name}: {stats['calls']} calls, {stats['failures']} failures, {latencies}")
+    logger.info(f"Hedged requests: {summary['hedges']}, won by hedge: {summary['hedge_wins']}")
+    logger.info(f"Translations shared with a concurrent identical request: {translation_flight.coalesced}")
+    if fuzzy_index is not None:
+        fuzzy = fuzzy_index.summary()
+        logger.info(f"Fuzzy matching: {fuzzy['lookups']} lookups, {fuzzy['normalized_hits']} normalized and {fuzzy['fuzzy_hits']} fuzzy matches over {fuzzy['entries']} strings")
 
 def batch_translate_texts(texts, batch_size=1, current_file=None, encoding_progress=None, encoding_name=None, total_files=None, current_file_index=None):
     results = []
     total_batches = (len(texts) + batch_size - 1) // batch_size
-    num_translators = len(translator_functions)
-    translator_index = 0  # Start with translator 1
 
-    def translate_batch(to_translate, translator_func, prefix, batch_index, translator_idx):
+    def translate_one(text):
+        # Cached before the flight ends, so a later caller finds it instead of calling again
+        translated_text = scheduler.translate(text)
+        translation_cache[text] = translated_text
+        index_translation(text)
+        return translated_text
+
+    def translate_batch(to_translate, prefix, batch_index):
         translations = []
         for text in to_translate:
-            translated_text = translator_func(text)
+            translated_text = translation_flight.do(text, lambda: translate_one(text))
             translations.append(translated_text)
-        logger.info(f"{prefix}Batch {batch_index} translation success with translator index {translator_idx + 1}")
+        logger.info(f"{prefix}Batch {batch_index} translation success")
         return translations
 
     for i in range(0, len(texts), batch_size):
@@ -93,40 +423,44 @@ def batch_translate_texts(texts, batch_size=1, current_file=None, encoding_progr
         if current_file is not None and encoding_progress is not None and encoding_name is not None:
             prefix = f"{current_file} <encoding conversion (GBK or UTF-8): {encoding_name} {encoding_progress}% ><translation progress: {translation_progress}% ><total progress: {total_progress}%> "
 
-        to_translate = [t for t in batch if t is not None and contains_chinese(t) and t.strip() != ""]
+        # Reviewed and cached strings never go back to the network
+        to_translate = [t for t in batch if t is not None and known_translation(t) is None and contains_chinese(t) and t.strip() != ""]
+        if fuzzy_index is not None:
+            # Near-duplicates go to fuzzy_cache, never indexed or exported, so matches cannot drift
+            for t in list(to_translate):
+                fuzzy = fuzzy_translation(t)
+                if fuzzy is not None:
+                    fuzzy_cache[t] = fuzzy
+                    to_translate.remove(t)
         if not to_translate:
-            results.extend(batch)
+            for t in batch:
+                known = known_translation(t) if t is not None else None
+                results.append(t if known is None else known)
             continue
 
         translations = None
-        tried_translators = 0
-        current_translator_index = translator_index
-
-        while tried_translators < num_translators:
-            try:
-                translations = translate_batch(to_translate, translator_functions[current_translator_index], prefix, batch_index, current_translator_index)
-                translator_index = (current_translator_index + 1) % num_translators
-                break
-            except Exception as e:
-                logger.warning(f"{prefix}Translator index {current_translator_index + 1} failed, switching to next translator immediately.")
-                current_translator_index = (current_translator_index + 1) % num_translators
-                tried_translators += 1
+        try:
+            translations = translate_batch(to_translate, prefix, batch_index)
+        except Exception as e:
+            logger.warning(f"{prefix}Batch {batch_index} failed on every translator: {e}")
 
         if translations is None:
+            # Failures are not cached, so the strings are retried once a backend recovers
             logger.error(f"{prefix}Batch translation failed with all translators. Returning original texts.")
-            translations = batch  # fallback to original texts
-
-        if not isinstance(translations, list):
-            translations = [translations]
+            translated_map = {}
+        else:
+            if not isinstance(translations, list):
+                translations = [translations]
+            # Map original to translated by position in to_translate
+            translated_map = dict(zip(to_translate, translations))
 
         for t in batch:
-            if t in translation_cache:
-                results.append(translation_cache[t])
+            known = known_translation(t) if t is not None else None
+            if known is not None:
+                results.append(known)
+            elif t in translated_map:
+                results.append(translated_map[t])
             else:
-                # Map original to translated if possible
-                idx_in_translations = batch.index(t)
-                translated_text = translations[idx_in_translations] if idx_in_translations < len(translations) else t
-                translation_cache[t] = translated_text
-                results.append(translated_text)
+                results.append(t)
 
     return results